@@ -4,14 +4,16 @@ from __future__ import unicode_literals
 from adminsortable2.admin import SortableInlineAdminMixin
 from cms.admin.pageadmin import PageAdmin
 from cms.extensions.admin import TitleExtensionAdmin
-from cms.models import Page, Title
+from cms.models import Page
 from django.conf.urls import url
 from django.contrib import admin, messages
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
-from .models import WorkflowExtension, Action,WorkflowStage, Workflow
+from .context import WorkflowContext
+from .models import WorkflowExtension, Action, NotificationPreference, TitleWorkflowState, WorkflowStage, Workflow
 from .views import WORKFLOW_VIEWS
 
 
@@ -79,21 +81,54 @@ class WorkflowPageAdmin(PageAdmin):
         return urls + super(WorkflowPageAdmin, self).get_urls()
 
     def publish_page(self, request, page_id, language):
-        title = get_object_or_404(Title, page_id=page_id, language=language, publisher_is_draft=True)
-        workflow = Workflow.get_workflow(title)
-        current_request = Action.get_current_request(title)
+        page = get_object_or_404(Page, pk=page_id, publisher_is_draft=True)
+        context = WorkflowContext.for_request(request, page, language)
+        if context.title is None:
+            raise Http404
 
         # legal publishing scenarios: no workflow defined for title OR current request is open and approved
-        if not workflow or (current_request and current_request.is_publishable()):
+        if context.publishable:
             return super(WorkflowPageAdmin, self).publish_page(request, page_id, language)
 
         # illegal publishing scenarios: current request not approved or no request at all
-        if current_request:
+        if context.current_request:
             messages.warning(request, self.OPEN_REQUEST_MESSAGE)
         else:
             messages.warning(request, self.NOT_REQUESTED_MESSAGE)
 
-        return redirect(title.page.get_absolute_url(language, fallback=True))
+        return redirect(page.get_absolute_url(language, fallback=True))
+
+
+class StatusListFilter(admin.SimpleListFilter):
+    title = _('Status')
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return Action.STATUS
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(status=self.value())
+        return queryset
+
+
+class RequiresActionListFilter(admin.SimpleListFilter):
+    title = _('Requires your action')
+    parameter_name = 'requires_action'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('yes', _('Yes')),
+            ('no', _('No')),
+        )
+
+    def queryset(self, request, queryset):
+        inbox = TitleWorkflowState.inbox(request.user).order_by().values('request_id')
+        if self.value() == 'yes':
+            return queryset.filter(pk__in=inbox)
+        if self.value() == 'no':
+            return queryset.exclude(pk__in=inbox)
+        return queryset
 
 
 class ActionAdmin(admin.ModelAdmin):
@@ -103,6 +138,7 @@ class ActionAdmin(admin.ModelAdmin):
 
     readonly_fields = ['title', 'workflow', 'status_display', 'page_link', 'requires_action']
     list_display = ['__str__', 'title', 'status_display', 'created', 'requires_action', 'page_link']
+    list_filter = [StatusListFilter, RequiresActionListFilter]
     fieldsets = (
         (None, {
             'fields': (('title', 'workflow', 'status_display', 'requires_action'),),
@@ -131,17 +167,36 @@ class ActionAdmin(admin.ModelAdmin):
         self.request = request
         qs = super(ActionAdmin, self).get_queryset(request)
         qs = qs.filter(depth=1)
+        # status, title and page are displayed for every request
+        qs = qs.with_status().select_related('title__page', 'workflow')
         return qs
 
+    def get_inbox(self, request):
+        """
+        Returns the pks of all requests requiring action by the current user, see
+        `TitleWorkflowState.inbox`.
+
+        :rtype: set
+        """
+        if not hasattr(request, '_workflow_inbox'):
+            inbox = TitleWorkflowState.inbox(request.user).order_by().values_list('request_id', flat=True)
+            request._workflow_inbox = set(inbox)
+        return request._workflow_inbox
+
     def requires_action(self, instance):
-        return self.request.user in instance.last_action().next_mandatory_stage_editors()
+        return instance.pk in self.get_inbox(self.request)
     requires_action.short_description = _('Requires your action')
     requires_action.boolean = True
 
     def page_link(self, instance):
         t = instance.title
+        page = t.page
+        # the title is already there, no need for the page to look it up again
+        title_cache = getattr(page, 'title_cache', None) or {}
+        title_cache.setdefault(t.language, t)
+        page.title_cache = title_cache
         return mark_safe('<a href="{link}" target="_top" class="close-sideframe-link">{label}</a>'.format(
-            link=t.page.get_draft_url(language=t.language, fallback=False),
+            link=page.get_draft_url(language=t.language, fallback=False),
             label=_('View page')
         ))
     page_link.short_description = _('View page in browser')
@@ -153,10 +208,17 @@ class ActionAdmin(admin.ModelAdmin):
 
     def extra_context(self, request, object_id):
         action = self.get_object(request, object_id)
-        actions = Action.get_tree(parent=action).order_by('depth')
+        actions = action.get_chain().select_related('stage__group', 'user')
         return {'actions': actions}
 
 
+class NotificationPreferenceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'digest')
+    list_filter = ('digest',)
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
 if admin.site.is_registered(Page):
     admin.site.unregister(Page)
 
@@ -164,3 +226,4 @@ admin.site.register(Page, WorkflowPageAdmin)
 admin.site.register(Workflow, WorkflowAdmin)
 admin.site.register(WorkflowExtension, WorkflowExtensionAdmin)
 admin.site.register(Action, ActionAdmin)
+admin.site.register(NotificationPreference, NotificationPreferenceAdmin)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import time
+from collections import OrderedDict
+
+from cms.api import add_plugin, create_page, create_title
+from cms.models import Title
+from cms.utils.conf import get_cms_setting
+from cms.utils.urlutils import admin_reverse
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
+from django.utils.encoding import force_text
+
+from .context import WorkflowContext
+from .models import Action, OutboxMessage, TitleWorkflowState, Workflow, WorkflowExtension, WorkflowStage
+
+PASSWORD = 'benchmark'
+
+
+class SyntheticSite(object):
+    """
+    Builds a synthetic site with a page tree of `depth` levels of `breadth` pages each, translated
+    into `languages`, `workflows` workflows of `stages` stages each (the first one being the
+    default, the others assigned to the root pages round robin) and `history` closed requests per
+    title. The first and the last leaf page are used as benchmark targets, the first one has an
+    open request at its first stage, both have unpublished changes.
+    """
+
+    def __init__(self, depth=3, breadth=3, languages=1, workflows=2, stages=3, history=5):
+        self.depth = depth
+        self.breadth = breadth
+        self.languages = [code for code, name in settings.LANGUAGES][:languages]
+        self.workflow_count = workflows
+        self.stage_count = stages
+        self.history = history
+        self.template = get_cms_setting('TEMPLATES')[0][0]
+        self.pages = []
+        self.workflows = []
+
+    @property
+    def language(self):
+        return self.languages[0]
+
+    def build(self):
+        user_model = get_user_model()
+        self.author = user_model.objects.create_superuser('benchmark-author', 'author@example.com', PASSWORD)
+        self.editor = user_model.objects.create_superuser('benchmark-editor', 'editor@example.com', PASSWORD)
+        self.build_workflows()
+        self.build_pages(parent=None, level=1)
+        for index, page in enumerate(self.pages):
+            if page.depth == 1:
+                self.assign_workflow(page, index)
+        for page in self.pages:
+            for title in page.title_set.all():
+                self.build_history(title)
+        self.open_page, self.idle_page = self.leaves[0], self.leaves[-1]
+        self.request_approval(self.open_page.title_set.get(language=self.language))
+        for page in (self.open_page, self.idle_page):
+            self.change_draft(page)
+        return self
+
+    def build_workflows(self):
+        for number in range(self.workflow_count):
+            workflow = Workflow.objects.create(name='Benchmark {}'.format(number), default=number == 0)
+            for order in range(self.stage_count):
+                group = Group.objects.create(name='Benchmark {}.{}'.format(number, order))
+                group.user_set.add(self.editor)
+                WorkflowStage.objects.create(workflow=workflow, group=group, order=order, optional=order % 2 == 1)
+            self.workflows.append(workflow)
+
+    def build_pages(self, parent, level):
+        for number in range(self.breadth):
+            name = '{} {}'.format(parent.get_title() if parent else 'Page', number)
+            page = create_page(name, self.template, self.language, parent=parent, published=True)
+            for language in self.languages[1:]:
+                create_title(language, name, page)
+                page.publish(language)
+            for language in self.languages:
+                for placeholder in page.get_placeholders():
+                    self.add_content(placeholder, language, name)
+            page = page.reload()
+            self.pages.append(page)
+            if level < self.depth:
+                self.build_pages(page, level + 1)
+
+    def add_content(self, placeholder, language, name):
+        if 'djangocms_text_ckeditor' in settings.INSTALLED_APPS:
+            for number in range(3):
+                add_plugin(placeholder, 'TextPlugin', language, body='<p>{} {}</p>'.format(name, number))
+
+    @property
+    def leaves(self):
+        return [page for page in self.pages if page.depth == self.depth]
+
+    def assign_workflow(self, page, index):
+        workflow = self.workflows[index % len(self.workflows)]
+        if workflow.default:
+            return
+        for title in page.title_set.all():
+            WorkflowExtension.objects.create(extended_object=title, workflow=workflow, descendants=True)
+
+    def build_history(self, title):
+        workflow = Workflow.get_workflow(title)
+        for number in range(self.history):
+            self.request_approval(title)
+            for stage in workflow.mandatory_stages:
+                Action.append(
+                    title=title, workflow=workflow, stage=stage, group=stage.group, user=self.editor,
+                    action_type=Action.APPROVE, message='',
+                )
+            closing = Action.PUBLISH if number % 2 else Action.CANCEL
+            Action.append(title=title, workflow=workflow, user=self.editor, action_type=closing, message='')
+
+    def request_approval(self, title):
+        return Action.append(
+            title=title, workflow=Workflow.get_workflow(title), user=self.author,
+            action_type=Action.REQUEST, message='Benchmark',
+        )
+
+    def change_draft(self, page):
+        for placeholder in page.get_placeholders():
+            self.add_content(placeholder, self.language, 'Changed')
+
+
+class Benchmark(object):
+    """
+    Measures query counts and wall-clock time of the workflow entry points on a synthetic site and
+    compares them to a baseline.
+    """
+
+    EXPLAIN = {
+        'postgresql': 'EXPLAIN ',
+        'mysql': 'EXPLAIN ',
+        'sqlite': 'EXPLAIN QUERY PLAN ',
+    }
+
+    def __init__(self, site, repeat=5, tolerance=0.5):
+        self.site = site
+        self.repeat = repeat
+        self.tolerance = tolerance
+        self.client = Client()
+
+    def entry_points(self):
+        site, language = self.site, self.site.language
+        open_page, idle_page = site.open_page, site.idle_page
+
+        def get(url):
+            def _get():
+                response = self.client.get(url)
+                assert response.status_code < 400, '{} returned {}'.format(url, response.status_code)
+            return _get
+
+        def workflow_url(action_type, page):
+            with translation.override(language):
+                return admin_reverse('workflow_{}'.format(action_type), args=[page.pk, language])
+
+        with translation.override(language):
+            edit_url = '{}?{}'.format(open_page.get_absolute_url(language), get_cms_setting('CMS_TOOLBAR_URL__EDIT_ON'))
+            changelist_url = admin_reverse('workflows_action_changelist')
+
+        title = open_page.title_set.get(language=language)
+        titles = list(Title.objects.filter(publisher_is_draft=True))
+
+        return OrderedDict([
+            ('edit_page', get(edit_url)),
+            ('request_view', get(workflow_url(Action.REQUEST, idle_page))),
+            ('approve_view', get(workflow_url(Action.APPROVE, open_page))),
+            ('reject_view', get(workflow_url(Action.REJECT, open_page))),
+            ('cancel_view', get(workflow_url(Action.CANCEL, open_page))),
+            ('diff_view', get(workflow_url(Action.DIFF, open_page))),
+            ('action_changelist', get(changelist_url)),
+            ('workflow_context', lambda: self.evaluate_context(open_page, language)),
+            ('get_workflow', lambda: Workflow.get_workflow(title)),
+            ('get_states', lambda: Action.get_states(titles)),
+            ('inbox', lambda: list(TitleWorkflowState.inbox(site.editor))),
+        ])
+
+    def evaluate_context(self, page, language):
+        request = RequestFactory().get(page.get_absolute_url(language))
+        request.user = self.site.editor
+        context = WorkflowContext(request, page, language)
+        return context.editable, context.publishable, context.next_stage
+
+    def run(self):
+        """
+        :return: {entry point: {'queries': int, 'time': float}}
+        :rtype: OrderedDict
+        """
+        self.client.login(username=self.site.editor.get_username(), password=PASSWORD)
+        results = OrderedDict()
+        for name, func in self.entry_points().items():
+            func()  # warm up caches
+            timings = []
+            queries = 0
+            for _ in range(self.repeat):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.time()
+                    func()
+                    timings.append(time.time() - start)
+                queries = max(queries, len(captured.captured_queries))
+            timings.sort()
+            results[name] = {'queries': queries, 'time': timings[len(timings) // 2]}
+        return results
+
+    def hot_queries(self):
+        """
+        The queries the workflow indexes are meant for.
+
+        :rtype: OrderedDict
+        """
+        site = self.site
+        title = site.open_page.title_set.get(language=site.language)
+        request = Action.get_current_request(title)
+        return OrderedDict([
+            ('latest_request', Action.get_requests(title).order_by('-created')[:1]),
+            ('chain', Action.objects.filter(path__startswith=request.path).order_by('depth')),
+            ('chain_head', Action.objects.filter(request_id=request.pk).order_by('-sequence')[:1]),
+            ('inbox', TitleWorkflowState.inbox(site.editor)),
+            ('outbox_due', OutboxMessage.objects.filter(
+                sent__isnull=True, send_after__lte=timezone.now()).order_by('send_after')[:100]),
+        ])
+
+    def explain(self):
+        """
+        :return: {query: plan} of all hot queries, empty for database vendors without known syntax
+        :rtype: OrderedDict
+        """
+        plans = OrderedDict()
+        prefix = self.EXPLAIN.get(connection.vendor)
+        if prefix is None:
+            return plans
+        with connection.cursor() as cursor:
+            for name, queryset in self.hot_queries().items():
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(prefix + sql, params)
+                plans[name] = '\n'.join(' '.join(force_text(column) for column in row) for row in cursor.fetchall())
+        return plans
+
+    def compare(self, results, baseline):
+        """
+        :return: descriptions of all regressions compared to the baseline
+        :rtype: list
+        """
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            expected = baseline[name]
+            if result['queries'] > expected['queries']:
+                regressions.append('{}: {} queries (baseline {})'.format(name, result['queries'], expected['queries']))
+            if result['time'] > expected['time'] * (1 + self.tolerance):
+                regressions.append('{}: {:.1f} ms (baseline {:.1f} ms)'.format(
+                    name, result['time'] * 1000, expected['time'] * 1000))
+        return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+
+def save_baseline(path, baseline):
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Two tier cache for workflow lookups:
+
+1. a per-request memo (thread local, only active while a request is handled) so repeated lookups
+   within the same request are free and
+2. the shared django cache (``settings.WORKFLOWS_CACHE``, defaults to ``'default'``) so lookups
+   are shared between requests and processes.
+
+Invalidation is done by the signal handlers in `workflows.signals.handlers`.
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_finished, request_started
+
+
+_local = threading.local()
+_missing = object()
+
+TITLE_WORKFLOW_KEY = 'workflows:title_workflow:{pk}'
+
+# cached for titles that resolve to the default workflow, so changing which workflow is the default
+# does not require invalidating any titles
+DEFAULT_WORKFLOW = 0
+
+
+def get_cache():
+    return caches[getattr(settings, 'WORKFLOWS_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'WORKFLOWS_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def get_memo():
+    """
+    Returns the memo dict of the current request or `None` outside of requests.
+
+    :rtype: dict | None
+    """
+    return getattr(_local, 'memo', None)
+
+
+def start_memo(**kwargs):
+    _local.memo = {}
+
+
+def clear_memo(**kwargs):
+    _local.memo = None
+
+
+request_started.connect(start_memo, dispatch_uid='workflows_start_memo')
+request_finished.connect(clear_memo, dispatch_uid='workflows_clear_memo')
+
+
+def memoize(key, func):
+    """
+    Returns the memoized value for `key`, calling `func` to compute it if necessary.
+    """
+    memo = get_memo()
+    if memo is None:
+        return func()
+    value = memo.get(key, _missing)
+    if value is _missing:
+        value = memo[key] = func()
+    return value
+
+
+def forget(*keys):
+    memo = get_memo()
+    if memo is not None:
+        for key in keys:
+            memo.pop(key, None)
+
+
+def get_title_workflow_id(title_id):
+    """
+    :return: the cached workflow pk, `DEFAULT_WORKFLOW` or `None` if nothing is cached
+    :rtype: int | None
+    """
+    return get_cache().get(TITLE_WORKFLOW_KEY.format(pk=title_id))
+
+
+def set_title_workflow_id(title_id, workflow_id):
+    get_cache().set(TITLE_WORKFLOW_KEY.format(pk=title_id), workflow_id, get_timeout())
+
+
+def invalidate_title_workflows(title_ids):
+    title_ids = list(title_ids)
+    forget(*[('workflow', pk) for pk in title_ids])
+    get_cache().delete_many([TITLE_WORKFLOW_KEY.format(pk=pk) for pk in title_ids])
+
+
+# process wide cache of versioned values: {key: (version, value, expiry timestamp)}
+_versioned = {}
+
+VERSION_KEY = 'workflows:version:{key}'
+
+
+def get_version(key):
+    """
+    Returns the current version token of `key` from the shared cache (memoized per request).
+
+    :rtype: str
+    """
+    def _get_version():
+        shared = get_cache()
+        version_key = VERSION_KEY.format(key=key)
+        version = shared.get(version_key)
+        if version is None:
+            shared.add(version_key, uuid.uuid4().hex, None)
+            version = shared.get(version_key)
+        return version
+    return memoize(('version', key), _get_version)
+
+
+def bump_version(key):
+    """
+    Invalidates the value of `key` in all processes.
+    """
+    forget(('version', key))
+    get_cache().set(VERSION_KEY.format(key=key), uuid.uuid4().hex, None)
+
+
+def get_local_timeout():
+    return getattr(settings, 'WORKFLOWS_LOCAL_CACHE_TIMEOUT', 60)
+
+
+def get_versioned(key, build):
+    """
+    Returns the value of `key` from the process wide cache, calling `build` to (re)build it if it is
+    missing, its version has been bumped or it is older than `WORKFLOWS_LOCAL_CACHE_TIMEOUT`
+    seconds. Versions are bumped before the changes are committed, so another process might
+    rebuild a value from the previous data meanwhile, the timeout limits how long it is served.
+    Values must not be modified as they are shared between threads.
+    """
+    version = get_version(key)
+    entry = _versioned.get(key)
+    now = time.time()
+    if entry is None or entry[0] != version or entry[2] < now:
+        entry = _versioned[key] = (version, build(), now + get_local_timeout())
+    return entry[1]
+
+
+GROUP_RECIPIENTS_KEY = 'workflows:group_users:{pk}'
+TITLE_URL_KEY = 'workflows:title_url:{version}:{pk}'
+
+# bumped whenever sites change, titles are invalidated one by one otherwise
+TITLE_URLS_VERSION = 'title_urls'
+
+
+def _get_or_build(key, build):
+    shared = get_cache()
+    value = shared.get(key)
+    if value is None:
+        value = build()
+        shared.set(key, value, get_timeout())
+    return value
+
+
+def get_group_recipients(group_id, build):
+    """
+    Returns the cached pks and email addresses of a group's users, calling `build` to look them up
+    if necessary.
+
+    :rtype: list[tuple]
+    """
+    return _get_or_build(GROUP_RECIPIENTS_KEY.format(pk=group_id), build)
+
+
+def invalidate_group_recipients(group_ids):
+    get_cache().delete_many([GROUP_RECIPIENTS_KEY.format(pk=pk) for pk in group_ids])
+
+
+def get_title_url(title_id, build):
+    """
+    Returns the cached absolute url of a title, calling `build` to resolve it if necessary.
+
+    :rtype: str
+    """
+    return _get_or_build(TITLE_URL_KEY.format(version=get_version(TITLE_URLS_VERSION), pk=title_id), build)
+
+
+def invalidate_title_urls(title_ids):
+    version = get_version(TITLE_URLS_VERSION)
+    get_cache().delete_many([TITLE_URL_KEY.format(version=version, pk=pk) for pk in title_ids])
+
+
+def public_diff_version_key(page_id, language):
+    """
+    Version key of the rendered placeholders of a public page, bumped on (un)publishing.
+    """
+    return 'diff_public:{}:{}'.format(page_id, language)
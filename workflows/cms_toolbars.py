@@ -8,10 +8,13 @@ from cms.toolbar_pool import toolbar_pool
 from cms.extensions.toolbar import ExtensionToolbar
 from cms.utils.urlutils import admin_reverse
 from cms.utils import get_language_list  # needed to get the page's languages
+from django.conf import settings
+from django.core.paginator import Paginator
 from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 
-from .models import Action, Workflow, WorkflowExtension
+from .context import WorkflowContext
+from .models import Action, TitleWorkflowState, WorkflowExtension
 
 
 def get_placeholder_toolbar():
@@ -69,7 +72,7 @@ class WorkflowPlaceholderToolbar(get_placeholder_toolbar()):
     def init_from_request(self):
         super(WorkflowPlaceholderToolbar, self).init_from_request()
         if self.page:
-            self.editable = Action.is_editable(self.page.title_set.filter(language=self.current_lang).first())
+            self.editable = WorkflowContext.for_request(self.request, self.page, self.current_lang).editable
             self.toolbar.content_renderer._placeholders_are_editable &= self.editable
 
     def add_structure_mode(self):
@@ -87,6 +90,7 @@ class WorkflowPageToolbar(PageToolbar):
         Action.CANCEL: _('Cancel request'),
         Action.DIFF: _('Diff view'),
     }
+    TEXT_DIFF_NAME = _('Text diff')
     current_request = None
 
     def add_page_menu(self):
@@ -100,13 +104,14 @@ class WorkflowPageToolbar(PageToolbar):
     def init_from_request(self):
         super(WorkflowPageToolbar, self).init_from_request()
         if self.page:
-            self.title = self.page.title_set.filter(language=self.current_lang).first()
-            self.workflow = Workflow.get_workflow(self.title)
-            self.current_request = Action.get_current_request(self.title)
-            self.current_action = Action.get_current_action(self.title)
-            self.user = self.request.user
-            self.next_stage = self.current_action.get_next_stage(self.user) if self.current_action else None
-            self.editable = Action.is_editable(self.title)
+            context = WorkflowContext.for_request(self.request, self.page, self.current_lang)
+            self.title = context.title
+            self.workflow = context.workflow
+            self.current_request = context.current_request
+            self.current_action = context.current_action
+            self.user = context.user
+            self.next_stage = context.next_stage
+            self.editable = context.editable
             self.in_app = self.in_apphook() and not self.in_apphook_root()
 
     def has_publish_permission(self):
@@ -131,18 +136,20 @@ class WorkflowPageToolbar(PageToolbar):
                 return False
             return self.current_request is None or self.current_request.is_closed()
         if action_type in (Action.APPROVE, Action.REJECT):
-            return self.current_action and self.current_action.get_next_stage(self.user)
+            return self.next_stage is not None
         if action_type == Action.DIFF:
             return self.has_dirty_objects()
         raise ValueError('Unknown action_type: {}'.format(action_type))
 
-    def _button(self, action_type):
+    def _button(self, action_type, name=None, query=None):
         with translation.override(self.current_lang):
             url = admin_reverse(
                 self.WORKFLOW_URL_NAME.format(action_type),
                 args=[self.page.pk, self.current_lang],
             )
-        return ModalButton(name=self.BUTTON_NAMES[action_type], url=url)
+        if query:
+            url = '{}?{}'.format(url, query)
+        return ModalButton(name=name or self.BUTTON_NAMES[action_type], url=url)
 
     def add_button(self, menu, action_type):
         if self.has_permission(action_type):
@@ -179,6 +186,8 @@ class WorkflowPageToolbar(PageToolbar):
         if self.toolbar.edit_mode and self.has_compare_permission():
             button_list = ButtonList(side=self.toolbar.RIGHT)
             self.add_button(button_list, Action.DIFF)
+            if self.has_permission(Action.DIFF):
+                button_list.buttons.append(self._button(Action.DIFF, name=self.TEXT_DIFF_NAME, query='mode=text'))
             self.toolbar.add_item(button_list)
 
     def add_publish_menu(self, classes=('cms-btn-action', 'cms-btn-publish', 'cms-btn-publish-active',)):
@@ -199,25 +208,40 @@ class WorkflowPageToolbar(PageToolbar):
 
 
 class EditorToolbar(CMSToolbar):
+    INBOX_SIZE = 10
+
     def populate(self):
+        inbox = Paginator(TitleWorkflowState.inbox(self.request.user), self.get_inbox_size()).page(1)
+        if not inbox.object_list:
+            return
         action_dropdown = Dropdown(side=self.toolbar.RIGHT,)
         action_dropdown.add_primary_button(
-            DropdownToggleButton(name=_('Pending your approval'))
+            DropdownToggleButton(name=_('Pending your approval ({count})').format(count=inbox.paginator.count))
         )
-        actions = Action.requiring_action(self.request.user)
-        if actions:
-            opts = Action._meta
-            view = '{app_label}_{model_name}_change'.format(
-                app_label=opts.app_label,
-                model_name=opts.model_name
+        opts = Action._meta
+        view = '{app_label}_{model_name}_change'.format(
+            app_label=opts.app_label,
+            model_name=opts.model_name
+        )
+        for state in inbox:
+            button = SideframeButton(
+                name=str(state.title),
+                url=admin_reverse(view, args=[state.request_id])
             )
-            for a in actions:
-                button = SideframeButton(
-                    name=str(a.title),
-                    url=admin_reverse(view, args=[a.get_request().pk])
-                )
-                action_dropdown.buttons.append(button)
-            self.toolbar.add_item(action_dropdown)
+            action_dropdown.buttons.append(button)
+        if inbox.has_next():
+            button = SideframeButton(
+                name=_('Show all'),
+                url=admin_reverse('{app_label}_{model_name}_changelist'.format(
+                    app_label=opts.app_label,
+                    model_name=opts.model_name
+                )) + '?requires_action=yes'
+            )
+            action_dropdown.buttons.append(button)
+        self.toolbar.add_item(action_dropdown)
+
+    def get_inbox_size(self):
+        return getattr(settings, 'WORKFLOWS_INBOX_SIZE', self.INBOX_SIZE)
 
 
 toolbar_pool.register(EditorToolbar)
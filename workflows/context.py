@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from cms.models import Title
+from django.utils.functional import cached_property
+
+from .models import Action, TitleWorkflowState, Workflow
+
+
+class WorkflowContext(object):
+    """
+    Workflow facts of a page translation for the current request. Everything is evaluated lazily and
+    at most once per request, no matter how many toolbars, views or checks make use of it.
+    """
+
+    def __init__(self, request, page, language):
+        self.request = request
+        self.page = page
+        self.language = language
+
+    @classmethod
+    def for_request(cls, request, page, language):
+        """
+        Returns the context for this page and language shared by everything handling `request`.
+
+        :type page: cms.models.Page
+        :type language: str
+        :rtype: WorkflowContext
+        """
+        contexts = getattr(request, '_workflow_contexts', None)
+        if contexts is None:
+            contexts = request._workflow_contexts = {}
+        key = (page.pk, language)
+        if key not in contexts:
+            contexts[key] = cls(request, page, language)
+        return contexts[key]
+
+    @cached_property
+    def title(self):
+        """
+        :rtype: Title | None
+        """
+        titles = Title.objects.filter(page=self.page, language=self.language)
+        title = titles.select_related('workflow_state__request', 'workflow_state__last_action').first()
+        if title is not None:
+            try:
+                state = title.workflow_state
+            except TitleWorkflowState.DoesNotExist:
+                state = None
+            setattr(title, TitleWorkflowState.CACHE_ATTR, state)
+        return title
+
+    @cached_property
+    def workflow(self):
+        """
+        :rtype: Workflow | None
+        """
+        return Workflow.get_workflow(self.title)
+
+    @cached_property
+    def user(self):
+        return self.request.user
+
+    @cached_property
+    def current_request(self):
+        """
+        :rtype: Action | None
+        """
+        if self.title is None or self.workflow is None:
+            return None
+        return Action.get_current_request(self.title)
+
+    @cached_property
+    def current_action(self):
+        """
+        :rtype: Action | None
+        """
+        if self.current_request is None:
+            return None
+        return self.current_request.last_action()
+
+    @cached_property
+    def next_stage(self):
+        """
+        The stage the user may approve or reject next, if any.
+
+        :rtype: workflows.models.WorkflowStage | None
+        """
+        if self.current_action is None:
+            return None
+        return self.current_action.get_next_stage(self.user)
+
+    @cached_property
+    def editable(self):
+        """
+        Can the title be edited at the moment? See `Action.is_editable`.
+
+        :rtype: bool
+        """
+        if self.title is None:
+            return True
+        if not self.title.publisher_is_draft:
+            return False
+        return self.current_request is None or self.current_request.is_closed()
+
+    @cached_property
+    def publishable(self):
+        """
+        Can the title be published with regard to its workflow?
+
+        :rtype: bool
+        """
+        if self.workflow is None:
+            return True
+        return self.current_request is not None and self.current_request.is_publishable()
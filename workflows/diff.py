@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from difflib import SequenceMatcher
+from operator import attrgetter
+
+from django.db import connection, models
+from django.utils.encoding import force_text
+from django.utils.html import escape
+from lxml import etree
+from lxml.html import fragment_fromstring
+from lxml.html.diff import htmldiff, parse_html
+
+
+CHANGED, UNCHANGED, ADDED, REMOVED, MOVED, TIMEOUT = 'changed', 'unchanged', 'added', 'removed', 'moved', 'timeout'
+
+# `html` is the diff or, for unchanged slots, the rendered slot
+SlotDiff = namedtuple('SlotDiff', ('slot', 'state', 'html'))
+
+# `digest` covers the plugin's content and all of its descendants
+PluginNode = namedtuple('PluginNode', ('instance', 'digest', 'children'))
+
+# `public` and `draft` are PluginNodes, `None` for added and removed plugins respectively
+PluginChange = namedtuple('PluginChange', ('state', 'public', 'draft'))
+
+# fields of CMSPlugin which differ between draft and public plugins without any change in content
+PLUGIN_BASE_FIELDS = (
+    'id', 'cmsplugin_ptr', 'placeholder', 'parent', 'position', 'language', 'creation_date',
+    'changed_date', 'path', 'depth', 'numchild',
+)
+
+# text plugins reference their child plugins by id, which changes on publishing
+PLUGIN_REFERENCE = re.compile(r'(<cms-plugin\b[^>]*?\bid=")\d+(")')
+
+
+def content_hash(rendered):
+    """
+    :type rendered: str
+    :rtype: str
+    """
+    return hashlib.sha1(rendered.encode('utf-8')).hexdigest()
+
+
+def diff_html(public_rendered, draft_rendered):
+    """
+    Returns the html diff of both renderings without empty insertions and deletions. This is a
+    module level function so it can be run in worker processes.
+
+    :rtype: str
+    """
+    diff = htmldiff(public_rendered, draft_rendered)
+    tree = parse_html(diff, cleanup=False)
+
+    for item in tree.xpath("//ins | //del"):
+        if len(item):
+            continue
+
+        content = item.text
+        if not (content and content.strip()):
+            item.getparent().remove(item)
+
+    return etree.tostring(tree, method='html', encoding='unicode')
+
+
+def tree_hash(trees):
+    """
+    Hashes the plugin trees of all placeholders of a page.
+
+    :param trees: {slot: [PluginNode]}
+    :rtype: str
+    """
+    return content_hash('\x1f'.join(
+        '{}:{}'.format(slot, ','.join(node.digest for node in nodes)) for slot, nodes in sorted(trees.items())
+    ))
+
+
+def pack(diffs):
+    """
+    :type diffs: list[SlotDiff]
+    :rtype: bytes
+    """
+    return zlib.compress(json.dumps([list(slot_diff) for slot_diff in diffs]).encode('utf-8'))
+
+
+def unpack(data):
+    """
+    :type data: bytes
+    :rtype: list[SlotDiff]
+    """
+    return [SlotDiff(*slot_diff) for slot_diff in json.loads(zlib.decompress(bytes(data)).decode('utf-8'))]
+
+
+def plugin_digest(instance, children=()):
+    """
+    Hashes the plugin type, the values of all content fields of the downcast plugin `instance` and
+    the digests of its `children`, so equal digests mean equal plugin trees whatever their ids.
+
+    :type children: list[PluginNode]
+    :rtype: str
+    """
+    values = [instance.plugin_type]
+    for field in instance._meta.concrete_fields:
+        if field.name in PLUGIN_BASE_FIELDS:
+            continue
+        value = force_text(field.value_from_object(instance))
+        values.append('{}={}'.format(field.name, PLUGIN_REFERENCE.sub(r'\1\2', value)))
+    values.extend(child.digest for child in children)
+    return content_hash('\x1f'.join(values))
+
+
+def plugin_tree(plugins):
+    """
+    Builds the plugin tree of one placeholder and sets `child_plugin_instances` on all plugins so
+    they can be rendered on their own.
+
+    :param plugins: downcast plugins of one placeholder and language
+    :return: the root plugins by position
+    :rtype: list[PluginNode]
+    """
+    children = defaultdict(list)
+    for plugin in plugins:
+        children[plugin.parent_id].append(plugin)
+
+    def node(plugin):
+        nodes = [node(child) for child in sorted(children[plugin.pk], key=attrgetter('position'))]
+        plugin.child_plugin_instances = [child.instance for child in nodes]
+        return PluginNode(plugin, plugin_digest(plugin, nodes), nodes)
+
+    return [node(plugin) for plugin in sorted(children[None], key=attrgetter('position'))]
+
+
+def align_plugins(public, draft):
+    """
+    Aligns the root plugins of a public and a draft placeholder by their digests. Unmatched plugins
+    equal to an unmatched plugin on the other side are considered moved. Within each replaced range,
+    the remaining plugins of the same type at the same offset are considered changed, all others
+    added or removed.
+
+    :type public: list[PluginNode]
+    :type draft: list[PluginNode]
+    :rtype: list[PluginChange]
+    """
+    matcher = SequenceMatcher(None, [node.digest for node in public], [node.digest for node in draft], autojunk=False)
+    opcodes = matcher.get_opcodes()
+
+    removed = defaultdict(list)
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != 'equal':
+            for node in public[i1:i2]:
+                removed[node.digest].append(node)
+    origins = {}
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != 'equal':
+            for node in draft[j1:j2]:
+                if removed[node.digest]:
+                    origins[id(node)] = removed[node.digest].pop(0)
+    moved = set(id(node) for node in origins.values())
+
+    changes = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            changes.extend(PluginChange(UNCHANGED, old, new) for old, new in zip(public[i1:i2], draft[j1:j2]))
+            continue
+        changes.extend(PluginChange(MOVED, origins[id(node)], node) for node in draft[j1:j2] if id(node) in origins)
+        old_nodes = [node for node in public[i1:i2] if id(node) not in moved]
+        new_nodes = [node for node in draft[j1:j2] if id(node) not in origins]
+        for index in range(max(len(old_nodes), len(new_nodes))):
+            old = old_nodes[index] if index < len(old_nodes) else None
+            new = new_nodes[index] if index < len(new_nodes) else None
+            if old and new and old.instance.plugin_type == new.instance.plugin_type:
+                changes.append(PluginChange(CHANGED, old, new))
+                continue
+            if old:
+                changes.append(PluginChange(REMOVED, old, None))
+            if new:
+                changes.append(PluginChange(ADDED, None, new))
+    return changes
+
+
+def plugin_text(instance):
+    """
+    Extracts the visible text of a plugin from its text fields without rendering it.
+
+    :rtype: list[str]
+    """
+    lines = []
+    for field in instance._meta.concrete_fields:
+        if field.name in PLUGIN_BASE_FIELDS or field.name == 'plugin_type' or field.choices:
+            continue
+        if not isinstance(field, (models.CharField, models.TextField)):
+            continue
+        value = field.value_from_object(instance)
+        if not value or not value.strip():
+            continue
+        text = fragment_fromstring(value, create_parent='div').text_content() if '<' in value else value
+        lines.extend(line.strip() for line in text.splitlines() if line.strip())
+    return lines
+
+
+def tree_text(nodes):
+    """
+    :type nodes: list[PluginNode]
+    :return: the visible text of all plugins in these trees, in order
+    :rtype: list[str]
+    """
+    lines = []
+    for node in nodes:
+        lines.extend(plugin_text(node.instance))
+        lines.extend(tree_text(node.children))
+    return lines
+
+
+def diff_words(public_text, draft_text):
+    """
+    :rtype: str
+    """
+    public_words, draft_words = public_text.split(), draft_text.split()
+    matcher = SequenceMatcher(None, public_words, draft_words, autojunk=False)
+    parts = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            parts.append(escape(' '.join(public_words[i1:i2])))
+            continue
+        if i2 > i1:
+            parts.append('<del>{}</del>'.format(escape(' '.join(public_words[i1:i2]))))
+        if j2 > j1:
+            parts.append('<ins>{}</ins>'.format(escape(' '.join(draft_words[j1:j2]))))
+    return ' '.join(parts)
+
+
+def diff_text(public_lines, draft_lines):
+    """
+    Diffs two texts line by line and replaced lines word by word. This is much cheaper than
+    `diff_html` but ignores markup.
+
+    :type public_lines: list[str]
+    :type draft_lines: list[str]
+    :rtype: str
+    """
+    matcher = SequenceMatcher(None, public_lines, draft_lines, autojunk=False)
+    paragraphs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            paragraphs.extend(escape(line) for line in public_lines[i1:i2])
+        elif tag == 'replace':
+            paragraphs.append(diff_words(' '.join(public_lines[i1:i2]), ' '.join(draft_lines[j1:j2])))
+        else:
+            paragraphs.extend('<del>{}</del>'.format(escape(line)) for line in public_lines[i1:i2])
+            paragraphs.extend('<ins>{}</ins>'.format(escape(line)) for line in draft_lines[j1:j2])
+    return ''.join('<p>{}</p>'.format(paragraph) for paragraph in paragraphs)
+
+
+class Deadline(object):
+    def __init__(self, timeout=None):
+        """
+        :param timeout: seconds from now or `None` for no deadline
+        """
+        self.end = None if timeout is None else time.time() + timeout
+
+    def remaining(self):
+        """
+        :rtype: float | None
+        """
+        if self.end is None:
+            return None
+        return max(0, self.end - time.time())
+
+    def passed(self):
+        return self.end is not None and time.time() >= self.end
+
+
+# pools shared by all requests of a process: {(executor class, workers, pid): executor}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(executor_class, workers):
+    """
+    Returns the pool of `workers` workers of this process. Pools are keyed by the process id as
+    forked processes (e.g. of a pre-forking server) cannot use the pools of their parent.
+
+    :type executor_class: type
+    :rtype: concurrent.futures.Executor
+    """
+    key = (executor_class, workers, os.getpid())
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = executor_class(max_workers=workers)
+        return _pools[key]
+
+
+def discard_pool(executor_class, workers):
+    with _pools_lock:
+        pool = _pools.pop((executor_class, workers, os.getpid()), None)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def collect(futures, deadline):
+    """
+    Waits for `futures` until the deadline and cancels those not started by then.
+
+    :param futures: {future: key}
+    :type deadline: Deadline
+    :return: the results of the finished futures by their keys
+    :rtype: dict
+    """
+    done, not_done = wait(futures, timeout=deadline.remaining())
+    for future in not_done:
+        future.cancel()
+    return {futures[future]: future.result() for future in done}
+
+
+def _in_thread(func):
+    # worker threads use their own database connections which must not be leaked
+    try:
+        return func()
+    finally:
+        connection.close()
+
+
+def run_in_threads(tasks, workers, deadline):
+    """
+    Runs the callables in `tasks` in the thread pool of this process.
+
+    :type tasks: dict
+    :type deadline: Deadline
+    :return: the results of all tasks finished before the deadline by the tasks' keys
+    :rtype: dict
+    """
+    if not tasks:
+        return {}
+    executor = get_pool(ThreadPoolExecutor, workers)
+    return collect({executor.submit(_in_thread, func): key for key, func in tasks.items()}, deadline)
+
+
+def diff_slots(slots, workers=0, deadline=None, process_threshold=None):
+    """
+    Diffs the public and draft renderings of all slots. With `workers`, slots larger than
+    `process_threshold` characters are diffed in the process pool of this process while the others
+    are diffed in this process meanwhile.
+
+    :param slots: {slot: (public_rendered, draft_rendered)}
+    :type deadline: Deadline
+    :return: the diffs of all slots finished before the deadline
+    :rtype: dict
+    """
+    deadline = deadline or Deadline()
+    large = {}
+    if workers and process_threshold is not None:
+        large = {
+            slot: rendered for slot, rendered in slots.items()
+            if len(rendered[0]) + len(rendered[1]) > process_threshold
+        }
+
+    futures = {}
+    if large:
+        try:
+            executor = get_pool(ProcessPoolExecutor, workers)
+            futures = {executor.submit(diff_html, *rendered): slot for slot, rendered in large.items()}
+        except BrokenProcessPool:
+            # a worker died, the next diff gets a new pool and this one diffs everything itself
+            discard_pool(ProcessPoolExecutor, workers)
+            large = {}
+
+    diffs = {}
+    for slot, rendered in slots.items():
+        if slot in large:
+            continue
+        if deadline.passed():
+            break
+        diffs[slot] = diff_html(*rendered)
+
+    if futures:
+        diffs.update(collect(futures, deadline))
+    return diffs
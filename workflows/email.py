@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from cms.utils.mail import send_mail
+from collections import OrderedDict
+
+from cms.utils.urlutils import admin_reverse, urljoin
 from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 from cms.models import Title
 
-from workflows.models import Action
+from workflows import cache, outbox
+from workflows.models import Action, NotificationPreference, PendingNotification, chunks
 
 
 EDITOR, AUTHOR = 'editor', 'author'
@@ -27,6 +34,8 @@ SUBJECTS = {
     },
 }
 
+DIGEST_SUBJECT = _('{project}: Workflow notifications')
+
 
 def send_action_mails(action, editor=None):
     """
@@ -37,33 +46,163 @@ def send_action_mails(action, editor=None):
     :type editor: django.contrib.auth.models.AbstractUser
     :rtype: bool
     """
-    sent = False
-
     if action.action_type not in SUBJECTS:
-        return sent
+        return False
     subjects = SUBJECTS[action.action_type]
     context = _context(action)
+    messages = []
 
     if AUTHOR in subjects:
         subject = subjects[AUTHOR].format(**context)
         txt_template = 'workflows/emails/author_{}.txt'.format(action.action_type)
-        to = get_to(action, to_user=action.get_author())
-        send_mail(subject, txt_template, to, context=context)
-        sent = True
+        to = postpone(action, AUTHOR, get_to(action, to_user=action.get_author()))
+        messages.extend(render_messages(subject, txt_template, to, context))
 
     if EDITOR in subjects:
         subject = subjects[EDITOR].format(**context)
-        to = get_to(action, to_user=editor)
+        to = postpone(action, EDITOR, get_to(action, to_user=editor))
         if to:
             txt_template = 'workflows/emails/editor_{}.txt'.format(action.action_type)
-            send_mail(subject, txt_template, to, context=context)
-            sent = True
+            messages.extend(render_messages(subject, txt_template, to, context))
+
+    deliver(messages)
+    return bool(messages)
+
+
+def postpone(action, role, recipients):
+    """
+    Holds the notification back for all recipients who prefer digests. Recipients are matched by
+    user as several users might share an email address.
+
+    :param recipients: (user pk, email) tuples
+    :return: the distinct email addresses to notify right away
+    :rtype: list[str]
+    """
+    if not recipients:
+        return []
+    digests = set(
+        NotificationPreference.objects.filter(
+            digest=True, user_id__in={user_id for user_id, email in recipients},
+        ).values_list('user_id', flat=True)
+    )
+    if digests:
+        PendingNotification.objects.bulk_create([
+            PendingNotification(user_id=user_id, action=action, role=role) for user_id in sorted(digests)
+        ])
+    to = []
+    for user_id, email in recipients:
+        if user_id not in digests and email not in to:
+            to.append(email)
+    return to
+
+
+def send_digests():
+    """
+    Sends every user with pending notifications a single mail listing all of them. Queued digests
+    are committed along with the deletion of their notifications, others are sent afterwards so
+    the notifications are not locked while the mail server is busy.
+
+    :return: the number of digests sent
+    :rtype: int
+    """
+    with transaction.atomic():
+        messages = collect_digests()
+        if outbox.is_enabled():
+            deliver(messages)
+    if not outbox.is_enabled():
+        deliver(messages)
+    return len(messages)
+
+
+def collect_digests():
+    """
+    Renders the digests of all pending notifications and deletes them, must be called in a
+    transaction. Only the notifications are locked, the entries are rendered with the per-action
+    templates and the authors and pages of all actions are fetched at once.
+
+    :rtype: list[EmailMessage]
+    """
+    pks = list(PendingNotification.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+    if not pks:
+        return []
+
+    pending = []
+    for batch in chunks(pks):
+        pending.extend(PendingNotification.objects.filter(pk__in=batch).select_related(
+            'user', 'action__user', 'action__title__page__site',
+        ))
+    pending.sort(key=lambda notification: (notification.user_id, notification.created, notification.pk))
+
+    actions = {notification.action_id: notification.action for notification in pending}
+    requests = Action.objects.select_related('user').in_bulk(
+        list({action.request_id or action.pk for action in actions.values()})
+    )
+    contexts = {}
+    for pk, action in actions.items():
+        # saves a title lookup per page when building its url
+        action.title.page.title_cache = {action.title.language: action.title}
+        contexts[pk] = _context(action, author=requests[action.request_id or action.pk].user)
+
+    by_user = OrderedDict()
+    for notification in pending:
+        by_user.setdefault(notification.user, []).append(notification)
+
+    messages = []
+    project = getattr(settings, 'PROJECT_NAME', 'djangocms-workflows')
+    for user, notifications in by_user.items():
+        if not user.email:
+            continue
+        entries = []
+        for notification in notifications:
+            action, context = notification.action, contexts[notification.action_id]
+            entries.append({
+                'subject': SUBJECTS[action.action_type][notification.role].format(**context),
+                'body': render_to_string(
+                    'workflows/emails/{}_{}.txt'.format(notification.role, action.action_type),
+                    dict(context, digest=True),
+                ),
+            })
+        context = {'recipient_name': get_name(user), 'entries': entries, 'project': project}
+        subject = DIGEST_SUBJECT.format(**context)
+        messages.extend(render_messages(subject, 'workflows/emails/digest.txt', [user.email], context))
+
+    for batch in chunks(pks):
+        PendingNotification.objects.filter(pk__in=batch).delete()
+    return messages
+
+
+def render_messages(subject, txt_template, to, context):
+    """
+    Renders the body once, with the same context `cms.utils.mail.send_mail` would use, and returns
+    one message per recipient so recipients do not see each other's addresses.
+
+    :type to: list[str]
+    :rtype: list[EmailMessage]
+    """
+    site = Site.objects.get_current()
+    context = dict(context, login_url='http://{}'.format(urljoin(site.domain, admin_reverse('index'))), title=subject)
+    body = render_to_string(txt_template, context)
+    return [EmailMessage(subject=subject, body=body, to=[recipient]) for recipient in to if recipient]
 
-    return sent
 
+def deliver(messages):
+    """
+    Queues the messages in the outbox with `WORKFLOWS_MAIL_OUTBOX`, otherwise sends them right away
+    over a single connection in batches of at most `WORKFLOWS_MAIL_BATCH_SIZE` messages.
+
+    :type messages: list[EmailMessage]
+    """
+    if outbox.is_enabled():
+        outbox.queue(messages)
+        return
+    connection = get_connection(fail_silently=True)
+    for batch in chunks(messages, outbox.get_batch_size()):
+        # opens the connection for and closes it after each batch
+        connection.send_messages(batch)
 
-def _context(action):
-    author = action.get_author()
+
+def _context(action, author=None):
+    author = author or action.get_author()
     editor = action.user
     context = {
         'url': get_absolute_url(action.title),
@@ -78,20 +217,28 @@ def _context(action):
 def get_to(action, to_user=None):
     """
     :type to_user: django.contrib.auth.models.AbstractUser
-    :param to_user:
-    :return:
+    :return: (user pk, email) tuples of the recipients
+    :rtype: list[tuple]
     """
     if to_user:
-        return [to_user.email]
-    return [user.email for user in action.next_mandatory_stage_editors()]
+        if not to_user.email or not getattr(to_user, 'is_active', True):
+            return []
+        return [(to_user.pk, to_user.email)]
+    return action.next_mandatory_stage_recipients()
 
 
 def get_absolute_url(title):
     """
+    Returns the absolute url of the title's page, cached until its path changes, its page is moved
+    or sites change.
+
     :type title: Title
-    :param title:
-    :return:
+    :rtype: str
     """
+    return cache.get_title_url(title.pk, lambda: _build_absolute_url(title))
+
+
+def _build_absolute_url(title):
     scheme = ['http', 'https'][getattr(settings, 'USE_HTTPS', False)]
     domain = title.page.site.domain
     path = title.page.get_absolute_url(language=title.language).lstrip('/')
@@ -5,7 +5,7 @@ from django import forms
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 
-from .models import Action
+from .models import Action, TitleWorkflowState
 
 
 class ActionForm(forms.Form):
@@ -23,6 +23,12 @@ class ActionForm(forms.Form):
         required=False
     )
 
+    # version of the title's workflow state the form was rendered for
+    version_ = forms.IntegerField(
+        widget=forms.HiddenInput,
+        required=False,
+    )
+
     def __init__(self, *args, **kwargs):
         self.stage = kwargs.pop('stage', None)
         self.title = kwargs.pop('title')
@@ -33,8 +39,11 @@ class ActionForm(forms.Form):
         self.group = getattr(self.stage, 'group', None)
         cr = Action.get_current_request(self.title)
         self.current_action = None if (not cr or cr.is_closed()) else cr.last_action()
+        state = TitleWorkflowState.get_for_title(self.title)
+        self.state_version = state.version if state is not None else 0
         self.user = self.request.user
         super(ActionForm, self).__init__(*args, **kwargs)
+        self.fields['version_'].initial = self.state_version
         self.adjust_editor()
 
     @property
@@ -75,9 +84,6 @@ class ActionForm(forms.Form):
             attr: getattr(self, attr) for attr in
             ('message', 'user', 'title', 'workflow', 'stage', 'action_type', 'group')
         }
-        if self.current_action is None:
-            assert self.action_type == Action.REQUEST  # root must be request
-            return Action.add_root(**init_kwargs)
-        else:
-            assert self.action_type != Action.REQUEST  # non-root must not be request
-            return self.current_action.add_child(**init_kwargs)
+        version = self.cleaned_data.get('version_')
+        # raises ActionConflict if someone else acted on the title since the form was rendered
+        return Action.append(version=self.state_version if version is None else version, **init_kwargs)
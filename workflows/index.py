@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+
+def build_workflow_index(Page, Title, WorkflowExtension, WorkflowIndex, page=None, languages=None, subtree=True):
+    """
+    (Re)builds the workflow index for all titles or for the titles of `page` (and its descendants if
+    `subtree` is set). Only the model classes' fields are used so this can be called with the
+    historical models of a migration as well.
+
+    A title's workflow is the one of its own extension or else inherited from the extension of the
+    closest ancestor title with `descendants` set. Titles without either are not indexed and
+    resolve to the default workflow.
+
+    :param languages: restrict the rebuild to these languages
+    :return: the pks of all titles whose index entries have been rebuilt
+    :rtype: list
+    """
+    pages = Page.objects.all()
+    titles = Title.objects.all()
+    extensions = WorkflowExtension.objects.all()
+    if page is not None:
+        if subtree:
+            pages = pages.filter(path__startswith=page.path)
+            titles = titles.filter(page__path__startswith=page.path)
+            extensions = extensions.filter(extended_object__page__path__startswith=page.path)
+        else:
+            pages = pages.filter(pk=page.pk)
+            titles = titles.filter(page=page)
+            extensions = extensions.filter(extended_object__page=page)
+    if languages is not None:
+        titles = titles.filter(language__in=languages)
+        extensions = extensions.filter(extended_object__language__in=languages)
+
+    # workflows inherited from ancestors of `page`: {language: (workflow_id, source_id)}
+    inherited = {}
+    if page is not None and page.depth > 1:
+        steplen = len(page.path) // page.depth
+        ancestor_paths = [page.path[:end] for end in range(steplen, len(page.path), steplen)]
+        ancestor_extensions = WorkflowExtension.objects.filter(
+            extended_object__page__path__in=ancestor_paths,
+            descendants=True,
+        )
+        if languages is not None:
+            ancestor_extensions = ancestor_extensions.filter(extended_object__language__in=languages)
+        ancestor_extensions = ancestor_extensions.order_by('extended_object__page__depth')  # top down
+        for language, workflow_id, source_id in ancestor_extensions.values_list(
+                'extended_object__language', 'workflow_id', 'extended_object_id'):
+            inherited[language] = (workflow_id, source_id)
+
+    own = {}
+    for page_id, language, workflow_id, descendants, source_id in extensions.values_list(
+            'extended_object__page_id', 'extended_object__language', 'workflow_id', 'descendants',
+            'extended_object_id'):
+        own[page_id, language] = (workflow_id, descendants, source_id)
+
+    page_titles = defaultdict(list)
+    title_ids = []
+    for page_id, language, title_id in titles.values_list('page_id', 'language', 'pk'):
+        page_titles[page_id].append((language, title_id))
+        title_ids.append(title_id)
+
+    entries = []
+    handed_down = {}  # path: {language: (workflow_id, source_id)} applying to the page's children
+    root_path = page.path if page is not None else None
+    for page_id, path, depth in pages.order_by('path').values_list('pk', 'path', 'depth'):
+        parent_path = path[:len(path) - len(path) // depth]
+        above = inherited if path == root_path else handed_down.get(parent_path, {})
+        below = above
+        for language, title_id in page_titles.get(page_id, ()):
+            workflow_id, source_id = above.get(language, (None, None))
+            if (page_id, language) in own:
+                workflow_id, descendants, source_id = own[page_id, language]
+                if descendants:
+                    if below is above:
+                        below = dict(above)
+                    below[language] = (workflow_id, source_id)
+            if workflow_id is not None:
+                entries.append(WorkflowIndex(title_id=title_id, workflow_id=workflow_id, source_id=source_id))
+        if subtree:
+            handed_down[path] = below
+
+    WorkflowIndex.objects.filter(title_id__in=titles.values('pk')).delete()
+    WorkflowIndex.objects.bulk_create(entries, batch_size=500)
+    return title_ids
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from workflows.models import Action
+
+
+class Command(BaseCommand):
+    help = (
+        'Converts all action chains to the tree or the flat storage (see WORKFLOWS_ACTION_STORAGE). '
+        'Switch the setting after converting.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('storage', choices=(Action.TREE_STORAGE, Action.FLAT_STORAGE))
+
+    def handle(self, *args, **options):
+        request_ids = list(Action.objects.filter(depth=1).values_list('pk', flat=True))
+        changed = 0
+        for request_id in request_ids:
+            # one chain at a time, so appends to other titles are not blocked meanwhile
+            changed += Action.convert_chain(request_id, options['storage'])
+        self.stdout.write('Converted {} chains, {} actions changed.'.format(len(request_ids), changed))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from cms.models import Page
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from workflows import cache
+from workflows.models import WorkflowIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the index of own and inherited workflows of all titles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page',
+            type=int,
+            dest='page',
+            help='Only rebuild the index of this page and its descendants.',
+        )
+        parser.add_argument(
+            '--language',
+            action='append',
+            dest='languages',
+            help='Only rebuild the index of titles in this language (can be repeated).',
+        )
+
+    def handle(self, *args, **options):
+        page = None
+        if options['page']:
+            try:
+                page = Page.objects.get(pk=options['page'])
+            except Page.DoesNotExist:
+                raise CommandError('Page {} does not exist.'.format(options['page']))
+
+        with transaction.atomic():
+            title_ids = WorkflowIndex.rebuild(page=page, languages=options['languages'])
+        cache.invalidate_title_workflows(title_ids)
+
+        self.stdout.write('Rebuilt workflow index of {} titles.'.format(len(title_ids)))
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from workflows.email import send_digests
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends every user who prefers digests one mail with all workflow notifications collected '
+        'since the last run. Meant to be run on a schedule, e.g. by cron.'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Sent {} digests.'.format(send_digests()))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from workflows import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends the workflow notification mails queued in the outbox (see WORKFLOWS_MAIL_OUTBOX). '
+        'Drains all due messages and exits unless --loop is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, dest='batch_size',
+                            help='Number of messages sent over one connection, defaults to WORKFLOWS_MAIL_BATCH_SIZE.')
+        parser.add_argument('--max-attempts', type=int, default=5, dest='max_attempts',
+                            help='Number of attempts before a message is given up.')
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='Seconds before the first retry, doubled with every further attempt.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new messages.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between polls with --loop.')
+        parser.add_argument('--purge', type=int, default=None,
+                            help='Delete messages sent more than this many days ago.')
+
+    def handle(self, *args, **options):
+        if options['purge'] is not None:
+            self.stdout.write('Purged {} sent messages.'.format(outbox.purge(options['purge'])))
+
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = outbox.send_batch(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                backoff=options['backoff'],
+            )
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write('Sent {} messages, {} failed.'.format(total_sent, total_failed))
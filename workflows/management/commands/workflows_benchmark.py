@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from workflows.benchmark import Benchmark, SyntheticSite, load_baseline, save_baseline
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds a synthetic site in a fresh test database and measures query counts and timings of '
+        'the workflow toolbars, views and lookups. Fails if any entry point regressed compared to '
+        'the stored baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=3, help='Depth of the page tree.')
+        parser.add_argument('--breadth', type=int, default=3, help='Number of child pages per page.')
+        parser.add_argument('--languages', type=int, default=1, help='Number of languages per page.')
+        parser.add_argument('--workflows', type=int, default=2, help='Number of workflows.')
+        parser.add_argument('--stages', type=int, default=3, help='Number of stages per workflow.')
+        parser.add_argument('--history', type=int, default=5, help='Number of closed requests per title.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of measurements per entry point.')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Allowed relative increase of timings before they count as regression.',
+        )
+        parser.add_argument(
+            '--baseline', default='workflows_benchmark.json',
+            help='Baseline file, results are stored per database vendor.',
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true', dest='update_baseline',
+            help='Store the results as new baseline instead of comparing them.',
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database.')
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Print the query plans of the queries backed by the workflow indexes. Use a large '
+                 'site, databases prefer table scans on small tables.',
+        )
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            site = SyntheticSite(
+                depth=options['depth'],
+                breadth=options['breadth'],
+                languages=options['languages'],
+                workflows=options['workflows'],
+                stages=options['stages'],
+                history=options['history'],
+            ).build()
+            benchmark = Benchmark(site, repeat=options['repeat'], tolerance=options['tolerance'])
+            results = benchmark.run()
+            plans = benchmark.explain() if options['explain'] else {}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=verbosity, keepdb=options['keepdb'])
+
+        for name, plan in plans.items():
+            self.stdout.write('{}:\n{}\n'.format(name, plan))
+
+        baselines = load_baseline(options['baseline'])
+        baseline = baselines.get(connection.vendor, {})
+        for name, result in results.items():
+            expected = baseline.get(name)
+            self.stdout.write('{:<20} {:>5} queries {:>9.1f} ms{}'.format(
+                name, result['queries'], result['time'] * 1000,
+                '' if expected is None else '   (baseline {} queries, {:.1f} ms)'.format(
+                    expected['queries'], expected['time'] * 1000),
+            ))
+
+        if options['update_baseline']:
+            baselines[connection.vendor] = results
+            save_baseline(options['baseline'], baselines)
+            self.stdout.write('Baseline stored in {}.'.format(options['baseline']))
+            return
+
+        regressions = benchmark.compare(results, baseline)
+        if regressions:
+            raise CommandError('Regressions found:\n' + '\n'.join(regressions))
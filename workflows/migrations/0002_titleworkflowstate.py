@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+CLOSED = {
+    'reject': 'rejected',
+    'cancel': 'cancelled',
+    'publish': 'published',
+}
+
+
+def next_mandatory_stage(WorkflowStage, action):
+    if action.action_type == 'request':
+        return WorkflowStage.objects.filter(
+            workflow_id=action.workflow_id, optional=False).order_by('order').first()
+    if action.action_type == 'approve' and action.stage_id:
+        stage = action.stage
+        return WorkflowStage.objects.filter(
+            workflow_id=stage.workflow_id, optional=False, order__gt=stage.order).order_by('order').first()
+    return None
+
+
+def create_states(apps, schema_editor):
+    Action = apps.get_model('workflows', 'Action')
+    WorkflowStage = apps.get_model('workflows', 'WorkflowStage')
+    TitleWorkflowState = apps.get_model('workflows', 'TitleWorkflowState')
+
+    requests = Action.objects.filter(depth=1)
+    for title_id in requests.values_list('title_id', flat=True).distinct():
+        request = requests.filter(title_id=title_id).latest('created')
+        last_action = Action.objects.filter(path__startswith=request.path).latest('depth')
+        next_stage = next_mandatory_stage(WorkflowStage, last_action)
+        if last_action.action_type in CLOSED:
+            status = CLOSED[last_action.action_type]
+        elif last_action.action_type == 'approve' and next_stage is None:
+            status = 'approved'
+        else:
+            status = 'requested'
+        TitleWorkflowState.objects.create(
+            title_id=title_id,
+            request=request,
+            last_action=last_action,
+            last_action_type=last_action.action_type,
+            next_stage=next_stage,
+            status=status,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0016_auto_20160608_1535'),
+        ('workflows', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TitleWorkflowState',
+            fields=[
+                ('title', models.OneToOneField(related_name='workflow_state', primary_key=True, serialize=False, to='cms.Title', verbose_name='Title')),
+                ('last_action_type', models.CharField(choices=[('request', 'request'), ('approve', 'approve'), ('reject', 'reject'), ('cancel', 'cancel'), ('publish', 'publish'), ('diff', 'diff')], max_length=10, verbose_name='Last action type')),
+                ('status', models.CharField(choices=[('requested', 'Requested'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('cancelled', 'Cancelled'), ('published', 'Published')], db_index=True, max_length=10, verbose_name='Status')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+                ('last_action', models.ForeignKey(related_name='+', to='workflows.Action', verbose_name='Last action')),
+                ('next_stage', models.ForeignKey(related_name='+', default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='workflows.WorkflowStage', verbose_name='Next mandatory stage')),
+                ('request', models.ForeignKey(related_name='+', to='workflows.Action', verbose_name='Current request')),
+            ],
+            options={
+                'verbose_name': 'Title workflow state',
+                'verbose_name_plural': 'Title workflow states',
+            },
+        ),
+        migrations.RunPython(create_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def fill_inbox_fields(apps, schema_editor):
+    TitleWorkflowState = apps.get_model('workflows', 'TitleWorkflowState')
+
+    for state in TitleWorkflowState.objects.select_related('last_action__stage', 'next_stage'):
+        last_action = state.last_action
+        state.workflow_id = last_action.workflow_id
+        if state.status in ('requested', 'approved'):
+            if last_action.action_type == 'approve' and last_action.stage_id:
+                state.stage_order_min = last_action.stage.order
+            if state.next_stage_id:
+                state.stage_order_max = state.next_stage.order
+        state.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0002_titleworkflowstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='titleworkflowstate',
+            name='workflow',
+            field=models.ForeignKey(related_name='+', null=True, to='workflows.Workflow', verbose_name='Workflow'),
+        ),
+        migrations.AddField(
+            model_name='titleworkflowstate',
+            name='stage_order_min',
+            field=models.PositiveSmallIntegerField(default=None, null=True, verbose_name='Stage order (exclusive minimum)'),
+        ),
+        migrations.AddField(
+            model_name='titleworkflowstate',
+            name='stage_order_max',
+            field=models.PositiveSmallIntegerField(default=None, null=True, verbose_name='Stage order (inclusive maximum)'),
+        ),
+        migrations.RunPython(fill_inbox_fields, migrations.RunPython.noop),
+    ]
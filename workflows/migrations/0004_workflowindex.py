@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from workflows.index import build_workflow_index
+
+
+def build_index(apps, schema_editor):
+    build_workflow_index(
+        apps.get_model('cms', 'Page'),
+        apps.get_model('cms', 'Title'),
+        apps.get_model('workflows', 'WorkflowExtension'),
+        apps.get_model('workflows', 'WorkflowIndex'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0016_auto_20160608_1535'),
+        ('workflows', '0003_titleworkflowstate_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowIndex',
+            fields=[
+                ('title', models.OneToOneField(related_name='workflow_index', primary_key=True, serialize=False, to='cms.Title', verbose_name='Title')),
+                ('source', models.ForeignKey(related_name='+', to='cms.Title', verbose_name='Source')),
+                ('workflow', models.ForeignKey(to='workflows.Workflow', verbose_name='Workflow')),
+            ],
+            options={
+                'verbose_name': 'Workflow index entry',
+                'verbose_name_plural': 'Workflow index entries',
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
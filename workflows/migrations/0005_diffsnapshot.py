@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0004_workflowindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiffSnapshot',
+            fields=[
+                ('request', models.OneToOneField(related_name='diff_snapshot', primary_key=True, serialize=False, to='workflows.Action', verbose_name='Request')),
+                ('draft_hash', models.CharField(max_length=40, verbose_name='Draft hash')),
+                ('data', models.BinaryField(verbose_name='Diff')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+            ],
+            options={
+                'verbose_name': 'Diff snapshot',
+                'verbose_name_plural': 'Diff snapshots',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0005_diffsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('subject', models.CharField(max_length=255, verbose_name='Subject')),
+                ('body', models.TextField(verbose_name='Body')),
+                ('recipients', models.TextField(verbose_name='Recipients')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('send_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Send after', db_index=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(verbose_name='Last error', blank=True)),
+                ('sent', models.DateTimeField(default=None, null=True, verbose_name='Sent', db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Outbox message',
+                'verbose_name_plural': 'Outbox messages',
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('workflows', '0006_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationPreference',
+            fields=[
+                ('user', models.OneToOneField(related_name='workflow_notification_preference', primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+                ('digest', models.BooleanField(default=False, help_text='Collect notifications and receive them as one digest mail (sent by the send_workflow_digests command).', verbose_name='Digest')),
+            ],
+            options={
+                'verbose_name': 'Notification preference',
+                'verbose_name_plural': 'Notification preferences',
+            },
+        ),
+        migrations.CreateModel(
+            name='PendingNotification',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('role', models.CharField(max_length=10, verbose_name='Role')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('action', models.ForeignKey(related_name='+', to='workflows.Action', verbose_name='Action')),
+                ('user', models.ForeignKey(related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Pending notification',
+                'verbose_name_plural': 'Pending notifications',
+            },
+        ),
+    ]
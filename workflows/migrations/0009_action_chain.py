@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import F
+
+
+def fill_chains(apps, schema_editor):
+    Action = apps.get_model('workflows', 'Action')
+    # chains are unary trees so far, the position of an action is its depth
+    Action.objects.update(sequence=F('depth') - 1)
+    for request_id, path in Action.objects.filter(depth=1).values_list('pk', 'path').iterator():
+        Action.objects.filter(path__startswith=path, depth__gt=1).update(request_id=request_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0008_titleworkflowstate_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='request',
+            field=models.ForeignKey(related_name='+', default=None, verbose_name='Request', to='workflows.Action', null=True),
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='sequence',
+            field=models.PositiveIntegerField(default=0, verbose_name='Sequence'),
+        ),
+        migrations.RunPython(fill_chains, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='action',
+            unique_together=set([('request', 'sequence')]),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# partial indexes are only supported by PostgreSQL, the path prefix (LIKE 'xxx%') index is
+# created there by django itself as `path` is a unique varchar
+PARTIAL_INDEXES = (
+    # open requests, see `TitleWorkflowState.inbox`
+    ('workflows_titleworkflowstate_open',
+     'ON workflows_titleworkflowstate (workflow_id, stage_order_max) '
+     "WHERE status IN ('requested', 'approved')"),
+    # due messages, see `workflows.outbox.send_batch`
+    ('workflows_outboxmessage_due',
+     'ON workflows_outboxmessage (send_after) WHERE sent IS NULL'),
+)
+
+
+def create_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in PARTIAL_INDEXES:
+        schema_editor.execute('CREATE INDEX {} {}'.format(name, definition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in PARTIAL_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0009_action_chain'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='action',
+            index_together=set([('title', 'depth', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='pendingnotification',
+            index_together=set([('user', 'created')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
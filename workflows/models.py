@@ -5,17 +5,53 @@ import logging
 
 from cms.extensions.extension_pool import extension_pool
 from cms.extensions.models import TitleExtension
-from cms.models import Title
+from cms.models import Page, Title
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
-from treebeard.mp_tree import MP_Node
+from treebeard.mp_tree import MP_Node, MP_NodeManager, MP_NodeQuerySet
+
+from . import cache, diff
+from .index import build_workflow_index
+from .stages import StageGraph
 
 logger = logging.getLogger('django.cms-workflows')
 
 
+class ActionConflict(Exception):
+    """
+    Raised when an action cannot be appended because the title's workflow state changed in the
+    meantime, e.g. another reviewer handled the request first.
+    """
+
+
+def chunks(items, size=500):
+    """
+    Splits `items` into lists of at most `size` items, e.g. to keep `IN` clauses within database limits.
+
+    :type items: list
+    :rtype: collections.Iterator[list]
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def get_group_ids(user):
+    """
+    Returns the pks of the user's groups (memoized per request).
+
+    :type user: django.contrib.auth.models.AbstractUser
+    :rtype: frozenset
+    """
+    if user is None or user.pk is None:
+        return frozenset()
+    return cache.memoize(('group_ids', user.pk), lambda: frozenset(user.groups.values_list('pk', flat=True)))
+
+
 class Workflow(models.Model):
     """
     Model representing a editorial workflow. A workflow is simply a sequence of ordered
@@ -41,10 +77,13 @@ class Workflow(models.Model):
         verbose_name = _('Workflow')
         verbose_name_plural = _('Workflows')
 
+    DEFAULT_WORKFLOW_KEY = 'default_workflow'
+
     def save(self, **kwargs):
         if self.default:
             Workflow.objects.filter(default=True).exclude(pk=self.pk).update(default=False)
         super(Workflow, self).save(**kwargs)
+        cache.bump_version(self.DEFAULT_WORKFLOW_KEY)
 
     def __str__(self):
         return self.name
@@ -52,8 +91,15 @@ class Workflow(models.Model):
     @classmethod
     def default_workflow(cls):
         """
+        The default workflow is cached process wide and invalidated whenever a workflow is saved or
+        deleted.
+
         :return: The default workflow if one exists, else `None`
         """
+        return cache.get_versioned(cls.DEFAULT_WORKFLOW_KEY, cls._get_default_workflow)
+
+    @classmethod
+    def _get_default_workflow(cls):
         try:
             return cls.objects.get(default=True)
         except cls.DoesNotExist:
@@ -66,54 +112,96 @@ class Workflow(models.Model):
     def get_workflow(cls, title):
         """Returns appropriate workflow for this title.
 
+        The result is memoized for the current request and the title's workflow is cached in the
+        shared cache (see `workflows.cache`).
+
         :type title: Title
         :rtype: Workflow | None
         :raises: Workflow.MultipleObjectsReturned
         """
-        if title is None:
+        if title is None or title.pk is None:
+            return cls._resolve_workflow(title)
+        return cache.memoize(('workflow', title.pk), lambda: cls._get_cached_workflow(title))
+
+    @classmethod
+    def get_workflows(cls, titles):
+        """Returns the appropriate workflows for many titles at once using a fixed number of queries.
+        The results are memoized for the current request like those of `get_workflow`.
+
+        :type titles: collections.Iterable[Title]
+        :return: {title: workflow}
+        :rtype: dict
+        """
+        titles = [title for title in titles if title is not None and title.pk is not None]
+        indexed = {}
+        for title_ids in chunks([title.pk for title in titles]):
+            entries = WorkflowIndex.objects.filter(title_id__in=title_ids).select_related('workflow')
+            indexed.update((entry.title_id, entry.workflow) for entry in entries)
+        default = None
+        if len(indexed) < len(titles):
+            default = cls.default_workflow()
+
+        workflows = {}
+        for title in titles:
+            workflow = workflows[title] = indexed.get(title.pk, default)
+            cache.memoize(('workflow', title.pk), lambda: workflow)
+        return workflows
+
+    @classmethod
+    def _get_cached_workflow(cls, title):
+        workflow_id = cache.get_title_workflow_id(title.pk)
+        if workflow_id == cache.DEFAULT_WORKFLOW:
             return cls.default_workflow()
-        # 1. check for custom workflow
-        try:
-            return title.workflowextension.workflow
-        except WorkflowExtension.DoesNotExist:
-            pass
+        if workflow_id is not None:
+            workflow = cls.objects.filter(pk=workflow_id).first()
+            if workflow is not None:
+                return workflow
+        workflow = cls._resolve_workflow(title, default=False)
+        cache.set_title_workflow_id(title.pk, workflow.pk if workflow else cache.DEFAULT_WORKFLOW)
+        return workflow or cls.default_workflow()
 
-        # 2. check for inherited workflow up the site tree
-        titles = Title.objects.filter(page__in=title.page.get_ancestors())  # all title of ancestor pages ...
-        titles = titles.filter(language=title.language)  # and same language ...
-        titles = titles.filter(workflowextension__descendants=True)  # that have an inherited workflow ...
-        titles = titles.order_by('-page__depth')  # bottom up
-        ancestor_title = titles.first()
+    @classmethod
+    def _resolve_workflow(cls, title, default=True):
+        """Resolves the workflow of this title from the database.
+
+        :type title: Title
+        :param default: whether to fall back to the default workflow
+        :rtype: Workflow | None
+        """
+        # 1. check for custom or inherited workflow, see `WorkflowIndex`
+        if title is not None and title.pk is not None:
+            index = WorkflowIndex.objects.select_related('workflow').filter(title_id=title.pk).first()
+            if index is not None:
+                return index.workflow
 
-        if ancestor_title:
-            return ancestor_title.workflowextension.workflow
+        # 2. check for default workflow, might be None
+        return cls.default_workflow() if default else None
 
-        # 3. check for default workflow, might be None
-        return cls.default_workflow()
+    @property
+    def stage_graph(self):
+        """
+        :rtype: workflows.stages.StageGraph
+        """
+        return WorkflowStage.get_graph(self.pk)
 
-    @cached_property
+    @property
     def mandatory_stages(self):
-        return self.stages.filter(optional=False)
+        return self.stage_graph.mandatory_stages
 
-    @cached_property
+    @property
     def first_mandatory_stage(self):
-        return self.mandatory_stages.first()
+        return self.stage_graph.first_mandatory_stage
 
     def possible_next_stages(self, stage=None):
         """
-        Return a queryset of all possible stages that can be used for the next action. These
+        Return a tuple of all possible stages that can be used for the next action. These
         are all stages starting with the very next stage up to and including the next mandatory
         stage.
         """
-        if stage:
-            return stage.possible_next_stages
-        fms = self.first_mandatory_stage
-        return self.stages.filter(order__lte=fms.order)
+        return self.stage_graph.possible_next_stages(stage)
 
     def next_mandatory_stage(self, stage=None):
-        if stage is None:
-            return self.first_mandatory_stage
-        return self.mandatory_stages.filter(order__gt=stage.order).first()
+        return self.stage_graph.next_mandatory_stage(stage)
 
 
 class WorkflowStage(models.Model):
@@ -156,17 +244,42 @@ class WorkflowStage(models.Model):
     def __str__(self):
         return self.group.name + ('[optional]' if self.optional else '')
 
-    @cached_property
+    @classmethod
+    def get_graph(cls, workflow_id):
+        """
+        Returns the compiled stage graph of this workflow. It is cached process wide and rebuilt
+        whenever the workflow's stages change (see `workflows.signals.handlers`).
+
+        :rtype: StageGraph
+        """
+        def build():
+            return StageGraph(cls.objects.filter(workflow_id=workflow_id).select_related('group').order_by('order'))
+        return cache.get_versioned(cls.graph_key(workflow_id), build)
+
+    @staticmethod
+    def graph_key(workflow_id):
+        return 'stage_graph:{}'.format(workflow_id)
+
+    @property
     def next_mandatory_stage(self):
-        return self.workflow.stages.filter(order__gt=self.order, optional=False).first()
+        return self.get_graph(self.workflow_id).next_mandatory_stage(self)
 
-    @cached_property
+    @property
     def possible_next_stages(self):
-        nms = self.next_mandatory_stage
-        pending = self.workflow.stages.filter(order__gt=self.order)
-        if nms is not None:
-            pending = pending.filter(order__lte=nms.order)
-        return pending
+        return self.get_graph(self.workflow_id).possible_next_stages(self)
+
+    def get_recipients(self):
+        """
+        Returns the pks and email addresses of the active users of this stage's group. They are
+        cached until group memberships or users change (see `workflows.signals.handlers`).
+
+        :return: (user pk, email) tuples
+        :rtype: list[tuple]
+        """
+        def build():
+            users = get_user_model().objects.filter(groups=self.group_id, is_active=True).exclude(email='')
+            return list(users.order_by('pk').values_list('pk', 'email'))
+        return cache.get_group_recipients(self.group_id, build)
 
 
 class WorkflowExtension(TitleExtension):
@@ -205,6 +318,132 @@ class WorkflowExtension(TitleExtension):
 extension_pool.register(WorkflowExtension)
 
 
+class WorkflowIndex(models.Model):
+    """
+    Precomputed effective workflow of a `cms.Title`: either the workflow of its own extension or the
+    one inherited from the closest ancestor whose extension applies to descendants. Titles without
+    an entry fall back to the default workflow. The index is updated by signal handlers whenever
+    extensions are changed or pages are moved and can be rebuilt with the `rebuild_workflow_index`
+    management command.
+    """
+    title = models.OneToOneField(
+        'cms.Title',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='workflow_index',
+        verbose_name=_('Title'),
+    )
+
+    workflow = models.ForeignKey(
+        'workflows.Workflow',
+        on_delete=models.CASCADE,
+        verbose_name=_('Workflow'),
+    )
+
+    # the title whose extension defines the workflow
+    source = models.ForeignKey(
+        'cms.Title',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Source'),
+    )
+
+    class Meta:
+        verbose_name = _('Workflow index entry')
+        verbose_name_plural = _('Workflow index entries')
+
+    def __str__(self):
+        return '#{}: {}'.format(self.title_id, self.workflow_id)
+
+    @classmethod
+    def rebuild(cls, page=None, languages=None, subtree=True):
+        """
+        Rebuilds the index for all titles or only for the titles of `page` (and its descendants).
+
+        :type page: cms.models.Page
+        :return: pks of all affected titles
+        :rtype: list
+        """
+        return build_workflow_index(
+            Page, Title, WorkflowExtension, cls, page=page, languages=languages, subtree=subtree
+        )
+
+
+class ActionQuerySet(MP_NodeQuerySet):
+
+    # the last action of a chain, correlated with the chain's request (root) in the outer query
+    LAST_ACTION_SQL = (
+        'SELECT {select} FROM {action} la '
+        'LEFT OUTER JOIN {stage} ls ON ls.id = la.stage_id '
+        'WHERE la.id = {action}.id OR la.request_id = {action}.id '
+        'ORDER BY la.sequence DESC LIMIT 1'
+    )
+
+    # the first mandatory stage of the last action's workflow after `{after}`
+    NEXT_MANDATORY_STAGE_SQL = (
+        'SELECT s.id FROM {stage} s '
+        'WHERE s.workflow_id = la.workflow_id AND s.optional = %s AND s.{order} > {after} '
+        'ORDER BY s.{order} LIMIT 1'
+    )
+
+    def with_status(self):
+        """
+        Annotates each request (root action) with its chain's `last_action_id`, `last_action_type`,
+        `next_stage_id` (the next mandatory stage) and `status` using subqueries, so requests can
+        be filtered and ordered by these in the database. The `status` annotation also takes the
+        place of `Action.status`.
+
+        :rtype: ActionQuerySet
+        """
+        quote_name = connections[self.db].ops.quote_name
+        tables = {
+            'action': quote_name(self.model._meta.db_table),
+            'stage': quote_name(WorkflowStage._meta.db_table),
+        }
+        next_stage = (
+            'CASE WHEN la.action_type = %s THEN ({first}) '
+            'WHEN la.action_type = %s AND ls.id IS NOT NULL THEN ({next}) '
+            'ELSE NULL END'
+        ).format(
+            first=self.NEXT_MANDATORY_STAGE_SQL.format(order=quote_name('order'), after=-1, **tables),
+            next=self.NEXT_MANDATORY_STAGE_SQL.format(order=quote_name('order'), after='ls.{}'.format(
+                quote_name('order')), **tables),
+        )
+        next_stage_params = [Action.REQUEST, False, Action.APPROVE, False]
+        status = (
+            'CASE WHEN la.action_type = %s THEN %s '
+            'WHEN la.action_type = %s THEN %s '
+            'WHEN la.action_type = %s THEN %s '
+            'WHEN la.action_type = %s AND ({next_stage}) IS NULL THEN %s '
+            'ELSE %s END'
+        ).format(next_stage=next_stage)
+        status_params = [
+            Action.CANCEL, Action.CANCELLED,
+            Action.PUBLISH, Action.PUBLISHED,
+            Action.REJECT, Action.REJECTED,
+            Action.APPROVE,
+        ] + next_stage_params + [Action.APPROVED, Action.REQUESTED]
+
+        def last_action(select, params=()):
+            sql = self.LAST_ACTION_SQL.format(select=select, **tables)
+            return RawSQL(sql, params)
+
+        return self.annotate(
+            last_action_id=last_action('la.id'),
+            last_action_type=last_action('la.action_type'),
+            next_stage_id=last_action(next_stage, next_stage_params),
+            status=last_action(status, status_params),
+        )
+
+
+class ActionManager(MP_NodeManager):
+    def get_queryset(self):
+        return ActionQuerySet(self.model).order_by('path')
+
+    def with_status(self):
+        return self.get_queryset().with_status()
+
+
 class Action(MP_Node):
     """
     Actions are the instantiations of workflow stages. They model a concrete editorial process that
@@ -240,7 +479,16 @@ class Action(MP_Node):
     1. REQUEST: --
     2. APPROVE: editor1
     3.  CANCEL: --
+
+    Every action also points to the `request` of its chain and has a `sequence` number within it.
+    With `WORKFLOWS_ACTION_STORAGE = 'flat'` actions are appended as direct children of their
+    request (depth 2, see `append`), so chains are read through `request` and `sequence` instead of
+    the tree. Only the request's `numchild` is updated besides, it counts all actions of the chain
+    as they are its children, so the tree stays valid for treebeard. `convert_action_storage`
+    converts existing chains.
     """
+    TREE_STORAGE, FLAT_STORAGE = 'tree', 'flat'
+
     REQUEST, APPROVE, REJECT, CANCEL, PUBLISH, DIFF = 'request', 'approve', 'reject', 'cancel', 'publish', 'diff'
     TYPES = (
         (REQUEST, _('request')),
@@ -259,6 +507,8 @@ class Action(MP_Node):
         (CANCELLED, _('Cancelled')),
         (PUBLISHED, _('Published')),
     )
+    OPEN_STATUS = (REQUESTED, APPROVED)
+    CLOSED_STATUS = (REJECTED, CANCELLED, PUBLISHED)
 
     title = models.ForeignKey(
         'cms.Title',
@@ -303,6 +553,22 @@ class Action(MP_Node):
         auto_now_add=True,
     )
 
+    # the request (root) of this action's chain, `None` for requests themselves
+    request = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Request'),
+        null=True,
+        default=None,
+    )
+
+    # position within the chain, 0 for requests
+    sequence = models.PositiveIntegerField(
+        _('Sequence'),
+        default=0,
+    )
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET_NULL,
@@ -314,23 +580,131 @@ class Action(MP_Node):
         _('Message'),
     )
 
+    objects = ActionManager()
+
+    # cache for `last_action`
+    _last_action = None
+
     class Meta:
         verbose_name = _('Workflow action')
         verbose_name_plural = _('Workflow actions')
         ordering = ('depth', 'created')
+        unique_together = (('request', 'sequence'),)
+        # the latest request of a title
+        index_together = (('title', 'depth', 'created'),)
 
     def __str__(self):
         return '#{}: {}'.format(self.title_id, self.action_type)
 
     def save(self, **kwargs):
-        if self.action_type == self.REQUEST:
-            try:
-                previous = Action.get_requests(title=self.title).exclude(pk=self.pk).latest('created')
-            except Action.DoesNotExist:
-                pass
+        created = self.pk is None
+        with transaction.atomic():
+            if created and self.action_type == self.REQUEST:
+                previous = TitleWorkflowState.get_for_title(self.title)
+                if previous is not None and previous.status not in self.CLOSED_STATUS:
+                    raise ActionConflict('Close previous request #{pk} before new request'.format(pk=previous.request_id))
+            if created and not self.is_root() and self.request_id is None:
+                # appended to the tree directly, e.g. with `add_child`
+                self.request_id = Action.objects.filter(path=self.path[:self.steplen]).values_list('pk', flat=True)[0]
+                self.sequence = self.depth - 1
+            super(Action, self).save(**kwargs)
+            if created:
+                TitleWorkflowState.track(self)
+
+    @classmethod
+    def append(cls, title, version=None, **kwargs):
+        """
+        Appends an action to the title's current request or, for requests, starts a new chain.
+        Appends are serialized per title by locking the title row, so concurrent reviewers cannot
+        create sibling actions.
+
+        :type title: Title
+        :param version: version of the title's workflow state the caller's decision was based on
+        :raises ActionConflict: if the state has changed since or does not allow this action
+        :rtype: Action
+        """
+        with transaction.atomic():
+            list(Title.objects.select_for_update().filter(pk=title.pk).values_list('pk', flat=True))
+            # the state might have changed while waiting for the lock
+            state = TitleWorkflowState.objects.select_related('request', 'last_action').filter(pk=title.pk).first()
+            setattr(title, TitleWorkflowState.CACHE_ATTR, state)
+
+            if version is not None and version != (state.version if state is not None else 0):
+                raise ActionConflict('Workflow state of title #{} has changed'.format(title.pk))
+            closed = state is None or state.status in cls.CLOSED_STATUS
+            if kwargs.get('action_type') == cls.REQUEST:
+                if not closed:
+                    raise ActionConflict('Title #{} already has an open request'.format(title.pk))
+                return cls.add_root(title=title, **kwargs)
+            if closed:
+                raise ActionConflict('Title #{} has no open request'.format(title.pk))
+
+            head, sequence = state.last_action, state.last_action.sequence + 1
+            if cls.get_storage() == cls.FLAT_STORAGE:
+                # no path of the chain changes, only the request gains a child
+                action = cls(
+                    title=title, request=state.request, sequence=sequence,
+                    path=cls._get_path(state.request.path, 2, sequence), depth=2, numchild=0, **kwargs
+                )
+                action.save()
+                cls.objects.filter(pk=state.request_id).update(numchild=models.F('numchild') + 1)
+                return action
+            return head.add_child(title=title, request=state.request, sequence=sequence, **kwargs)
+
+    @staticmethod
+    def get_storage():
+        """
+        :return: `TREE_STORAGE` or `FLAT_STORAGE`
+        :rtype: str
+        """
+        return getattr(settings, 'WORKFLOWS_ACTION_STORAGE', Action.TREE_STORAGE)
+
+    @classmethod
+    def convert_chain(cls, request_id, storage):
+        """
+        Rewrites the paths of a chain for `storage`. Sequences and requests stay the same, so this
+        never changes the order of a chain. The title row is locked like in `append`, so no action
+        can be appended to the chain while it is rewritten.
+
+        :return: the number of actions changed
+        :rtype: int
+        """
+        with transaction.atomic():
+            title_id = cls.objects.filter(pk=request_id).values_list('title_id', flat=True).get()
+            list(Title.objects.select_for_update().filter(pk=title_id).values_list('pk', flat=True))
+            return cls._convert_chain(request_id, storage)
+
+    @classmethod
+    def _convert_chain(cls, request_id, storage):
+        chain = list(
+            cls.objects.filter(models.Q(pk=request_id) | models.Q(request_id=request_id)).order_by('sequence')
+        )
+        request, actions = chain[0], chain[1:]
+        changed = 0
+        parent_path = request.path
+        for index, action in enumerate(actions):
+            if storage == cls.FLAT_STORAGE:
+                path, depth, numchild = cls._get_path(request.path, 2, action.sequence), 2, 0
             else:
-                assert previous.is_closed(), 'Close previous request #{pk} before new request'.format(pk=previous.pk)
-        super(Action, self).save(**kwargs)
+                depth = action.sequence + 1
+                path, numchild = cls._get_path(parent_path, depth, 1), int(index < len(actions) - 1)
+            parent_path = path
+            if (action.path, action.depth, action.numchild) != (path, depth, numchild):
+                cls.objects.filter(pk=action.pk).update(path=path, depth=depth, numchild=numchild)
+                changed += 1
+        numchild = len(actions) if storage == cls.FLAT_STORAGE else int(bool(actions))
+        if request.numchild != numchild:
+            cls.objects.filter(pk=request.pk).update(numchild=numchild)
+        return changed
+
+    def get_chain(self):
+        """
+        Returns all actions of this action's chain in order.
+
+        :rtype: django.db.models.query.QuerySet
+        """
+        request_id = self.request_id or self.pk
+        return Action.objects.filter(models.Q(pk=request_id) | models.Q(request_id=request_id)).order_by('sequence')
 
     def is_closed(self):
         return self.last_action().action_type in (self.REJECT, self.CANCEL, self.PUBLISH)
@@ -341,7 +715,7 @@ class Action(MP_Node):
         :rtype: Action
         :return:
         """
-        return self.get_root()
+        return self if self.request_id is None else self.request
 
     def get_author(self):
         """Return author of changes.
@@ -349,19 +723,32 @@ class Action(MP_Node):
         :rtype: django.contrib.auth.models.AbstractUser
         :return: author of changes
         """
-        return self.get_request().user
+        if self.request_id is None:
+            return self.user
+        return Action.objects.select_related('user').get(pk=self.request_id).user
 
     def next_mandatory_stage(self):
         """
         :rtype: WorkflowStage
         :return:
         """
+        graph = WorkflowStage.get_graph(self.workflow_id)
         if self.action_type == self.REQUEST:
-            return self.workflow.first_mandatory_stage
-        if self.action_type == self.APPROVE and self.stage:
-            return self.stage.next_mandatory_stage
+            return graph.first_mandatory_stage
+        if self.action_type == self.APPROVE and self.stage_id:
+            return graph.next_mandatory_stage(self.stage_id)
         return None
 
+    def next_mandatory_stage_recipients(self):
+        """
+        :return: (user pk, email) tuples of the active users of the next mandatory stage's group
+        :rtype: list[tuple]
+        """
+        nms = self.next_mandatory_stage()
+        if not nms:
+            return []
+        return nms.get_recipients()
+
     def next_mandatory_stage_editors(self):
         nms = self.next_mandatory_stage()
         if not nms:
@@ -369,15 +756,19 @@ class Action(MP_Node):
         return nms.group.user_set.all()
 
     def possible_next_stages(self):
-        return self.workflow.possible_next_stages(self.stage)
+        return WorkflowStage.get_graph(self.workflow_id).possible_next_stages(self.stage_id)
 
     def last_action(self):
         """
-        Returns the latest action of this action's action chain.
+        Returns the latest action of this action's action chain. The result is cached on the
+        instance; requests returned by `get_current_request` already come with it.
 
         :rtype: Action
         """
-        return Action.get_tree(parent=self).latest('depth')
+        if self._last_action is None:
+            head = Action.objects.filter(request_id=self.request_id or self.pk).order_by('-sequence').first()
+            self._last_action = head or self
+        return self._last_action
 
     def is_publishable(self):
         """
@@ -385,31 +776,34 @@ class Action(MP_Node):
 
         :rtype: bool
         """
-        if self.is_closed():  # rejected, cancelled, or already published?
-            return False
-        last_action = self.last_action()
-        if last_action.action_type != self.APPROVE:
-            return False
-        return last_action.next_mandatory_stage() is None
+        return self.status == self.APPROVED
 
     def get_next_stage(self, user):
         if self.is_closed():
             return None
-        return self.possible_next_stages().filter(group__user=user).last()
+        group_ids = get_group_ids(user)
+        stages = [stage for stage in self.possible_next_stages() if stage.group_id in group_ids]
+        return stages[-1] if stages else None
 
-    @cached_property
-    def status(self):
-        la = self.last_action()
-        if la.action_type == self.CANCEL:
+    def chain_status(self):
+        """
+        Status of an action chain that ends with this action.
+
+        :rtype: str
+        """
+        if self.action_type == self.CANCEL:
             return self.CANCELLED
-        if la.action_type == self.PUBLISH:
+        if self.action_type == self.PUBLISH:
             return self.PUBLISHED
-        if la.action_type == self.REJECT:
+        if self.action_type == self.REJECT:
             return self.REJECTED
-        if self.is_publishable():
+        if self.action_type == self.APPROVE and self.next_mandatory_stage() is None:
             return self.APPROVED
-        else:
-            return self.REQUESTED
+        return self.REQUESTED
+
+    @cached_property
+    def status(self):
+        return self.last_action().chain_status()
 
     @cached_property
     def status_display(self):
@@ -430,14 +824,16 @@ class Action(MP_Node):
 
         :rtype: Action
         """
+        if title is None:
+            return None
         workflow = Workflow.get_workflow(title)
         if workflow is None:
             return None
-        try:
-            # there can only be one open request per title at a time and it must be the last
-            return cls.get_requests(title=title).latest('created')
-        except cls.DoesNotExist:
+        # there can only be one open request per title at a time and it must be the last
+        state = TitleWorkflowState.get_for_title(title)
+        if state is None:
             return None
+        return state.get_request()
 
     @classmethod
     def get_current_action(cls, title):
@@ -450,9 +846,33 @@ class Action(MP_Node):
         """
         latest_request = cls.get_current_request(title)
         if latest_request:
-            return cls.get_tree(parent=latest_request).latest('depth')
+            return latest_request.last_action()
         return None
 
+    @classmethod
+    def get_states(cls, titles):
+        """
+        Returns the workflow states (see `TitleWorkflowState`) of many titles at once using a fixed
+        number of queries. Titles without workflow or without any request map to `None`. The
+        states are cached on the titles so subsequent calls of e.g. `get_current_request` or
+        `is_editable` with these titles do not query them again.
+
+        :type titles: collections.Iterable[Title]
+        :return: {title: state}
+        :rtype: dict
+        """
+        workflows = Workflow.get_workflows(titles)
+        states = {}
+        for title_ids in chunks([title.pk for title, workflow in workflows.items() if workflow is not None]):
+            title_states = TitleWorkflowState.objects.filter(title_id__in=title_ids)
+            states.update((state.title_id, state) for state in title_states.select_related('request', 'last_action'))
+        result = {}
+        for title, workflow in workflows.items():
+            state = result[title] = states.get(title.pk)
+            if workflow is not None:
+                setattr(title, TitleWorkflowState.CACHE_ATTR, state)
+        return result
+
     @classmethod
     def is_editable(cls, title):
         """
@@ -477,9 +897,388 @@ class Action(MP_Node):
         :type user: django.contrib.auth.models.User
         :rtype: list
         """
-        actions = []
-        for title in Title.objects.filter(action__isnull=False).distinct():
-            ca = cls.get_current_action(title)
-            if user in ca.next_mandatory_stage_editors():
-                actions.append(ca)
-        return actions
+        return [state.get_request().last_action() for state in TitleWorkflowState.inbox(user)]
+
+
+class TitleWorkflowState(models.Model):
+    """
+    Denormalized workflow state of a `cms.Title`. It points to the title's current request and to
+    the last action of that request's chain and is maintained whenever an action is appended (see
+    `Action.save`), so all status checks boil down to a single primary key lookup instead of walking
+    the action tree.
+    """
+    title = models.OneToOneField(
+        'cms.Title',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='workflow_state',
+        verbose_name=_('Title'),
+    )
+
+    request = models.ForeignKey(
+        'workflows.Action',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Current request'),
+    )
+
+    last_action = models.ForeignKey(
+        'workflows.Action',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Last action'),
+    )
+
+    last_action_type = models.CharField(
+        _('Last action type'),
+        max_length=10,
+        choices=Action.TYPES,
+    )
+
+    next_stage = models.ForeignKey(
+        'workflows.WorkflowStage',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name=_('Next mandatory stage'),
+        null=True,
+        default=None,
+    )
+
+    workflow = models.ForeignKey(
+        'workflows.Workflow',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Workflow'),
+        null=True,
+    )
+
+    # the stages that may act next are those of `workflow` with an order in
+    # (stage_order_min, stage_order_max], a missing bound is unbounded
+    stage_order_min = models.PositiveSmallIntegerField(
+        _('Stage order (exclusive minimum)'),
+        null=True,
+        default=None,
+    )
+
+    stage_order_max = models.PositiveSmallIntegerField(
+        _('Stage order (inclusive maximum)'),
+        null=True,
+        default=None,
+    )
+
+    status = models.CharField(
+        _('Status'),
+        max_length=10,
+        choices=Action.STATUS,
+        db_index=True,
+    )
+
+    updated = models.DateTimeField(
+        _('Updated'),
+        auto_now=True,
+    )
+
+    # incremented with every appended action, see `Action.append`
+    version = models.PositiveIntegerField(
+        _('Version'),
+        default=0,
+    )
+
+    # attribute the state is cached under on title instances
+    CACHE_ATTR = '_workflow_state'
+
+    class Meta:
+        verbose_name = _('Title workflow state')
+        verbose_name_plural = _('Title workflow states')
+
+    def __str__(self):
+        return '#{}: {}'.format(self.title_id, self.status)
+
+    @classmethod
+    def get_for_title(cls, title):
+        """
+        Returns the workflow state of this title (cached on the title instance).
+
+        :type title: Title
+        :rtype: TitleWorkflowState | None
+        """
+        if title is None or title.pk is None:
+            return None
+        if not hasattr(title, cls.CACHE_ATTR):
+            state = cls.objects.select_related('request', 'last_action').filter(pk=title.pk).first()
+            setattr(title, cls.CACHE_ATTR, state)
+        return getattr(title, cls.CACHE_ATTR)
+
+    @classmethod
+    def inbox(cls, user):
+        """
+        Returns the states of all open requests that can be approved or rejected by this user,
+        i.e. one of the request's possible next stages is associated with one of the user's groups.
+        This is a single query regardless of the number of titles and actions.
+
+        :type user: django.contrib.auth.models.User
+        :rtype: django.db.models.query.QuerySet
+        """
+        # all conditions on `workflow__stages` have to be in one filter call to apply to the same stage
+        states = cls.objects.filter(
+            models.Q(workflow__stages__group__user=user),
+            models.Q(stage_order_min__isnull=True) | models.Q(workflow__stages__order__gt=models.F('stage_order_min')),
+            models.Q(stage_order_max__isnull=True) | models.Q(workflow__stages__order__lte=models.F('stage_order_max')),
+            status__in=Action.OPEN_STATUS,
+        )
+        states = states.select_related('title', 'request', 'last_action')
+        return states.distinct().order_by('-updated')
+
+    @classmethod
+    def track(cls, action):
+        """
+        Updates the state of the action's title after the action has been appended.
+
+        :type action: Action
+        :rtype: TitleWorkflowState | None
+        """
+        title = action.title
+        state = cls.get_for_title(title)
+        if action.request_id is None:
+            request = action
+        elif state is not None and action.request_id == state.request_id:
+            request = state.request
+        else:
+            request = action.request
+            if state is not None and state.request.created > request.created:
+                # appended to an outdated chain, current state is unaffected
+                return state
+        defaults = cls.get_stage_values(action)
+        defaults.update({
+            'version': (state.version if state is not None else 0) + 1,
+            'request': request,
+            'last_action': action,
+            'last_action_type': action.action_type,
+            'workflow_id': action.workflow_id,
+        })
+        state, _ = cls.objects.update_or_create(title_id=title.pk, defaults=defaults)
+        setattr(title, cls.CACHE_ATTR, state)
+        return state
+
+    @staticmethod
+    def get_stage_values(action):
+        """
+        Computes the fields of a state which depend on the stages of its workflow.
+
+        :param action: the last action of the state's chain
+        :rtype: dict
+        """
+        status = action.chain_status()
+        next_stage = action.next_mandatory_stage()
+        stage_order_min = stage_order_max = None
+        if status in Action.OPEN_STATUS:
+            stage = WorkflowStage.get_graph(action.workflow_id).get(action.stage_id)
+            if action.action_type == Action.APPROVE and stage is not None:
+                stage_order_min = stage.order
+            if next_stage is not None:
+                stage_order_max = next_stage.order
+        return {
+            'next_stage_id': next_stage.pk if next_stage is not None else None,
+            'stage_order_min': stage_order_min,
+            'stage_order_max': stage_order_max,
+            'status': status,
+        }
+
+    @classmethod
+    def refresh_workflow(cls, workflow_id):
+        """
+        Recomputes the open states of a workflow after its stages have been changed, e.g. an
+        approved request is requested again once a mandatory stage has been added. Changed states
+        get a new version, so decisions based on the previous one are rejected.
+
+        :return: the number of changed states
+        :rtype: int
+        """
+        states = cls.objects.filter(workflow_id=workflow_id, status__in=Action.OPEN_STATUS)
+        changed = 0
+        for state in states.select_related('last_action'):
+            values = cls.get_stage_values(state.last_action)
+            if any(getattr(state, name) != value for name, value in values.items()):
+                cls.objects.filter(pk=state.pk).update(version=models.F('version') + 1, **values)
+                changed += 1
+        return changed
+
+    def get_request(self):
+        """
+        Returns the current request with its chain's last action and status preset, so neither
+        needs to be looked up again.
+
+        :rtype: Action
+        """
+        request, last_action = self.request, self.last_action
+        request._last_action = last_action._last_action = last_action
+        request.__dict__['status'] = self.status
+        return request
+
+
+class DiffSnapshot(models.Model):
+    """
+    The diff of a title's draft against its public version, captured when the request was created
+    and served to all approvers for as long as the draft's content hash stays the same.
+    """
+    request = models.OneToOneField(
+        'workflows.Action',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='diff_snapshot',
+        verbose_name=_('Request'),
+    )
+
+    draft_hash = models.CharField(
+        _('Draft hash'),
+        max_length=40,
+    )
+
+    # zlib compressed json, see `workflows.diff.pack`
+    data = models.BinaryField(
+        _('Diff'),
+    )
+
+    updated = models.DateTimeField(
+        _('Updated'),
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = _('Diff snapshot')
+        verbose_name_plural = _('Diff snapshots')
+
+    def __str__(self):
+        return '#{}: {}'.format(self.request_id, self.draft_hash)
+
+    def get_diffs(self):
+        """
+        :rtype: list[workflows.diff.SlotDiff]
+        """
+        return diff.unpack(self.data)
+
+
+class OutboxMessage(models.Model):
+    """
+    A notification email queued in the transaction of the action it notifies about and sent later
+    by the `send_workflow_mails` command (see `workflows.outbox`).
+    """
+    subject = models.CharField(
+        _('Subject'),
+        max_length=255,
+    )
+
+    body = models.TextField(
+        _('Body'),
+    )
+
+    # one address per line
+    recipients = models.TextField(
+        _('Recipients'),
+    )
+
+    created = models.DateTimeField(
+        _('Created'),
+        auto_now_add=True,
+    )
+
+    send_after = models.DateTimeField(
+        _('Send after'),
+        default=timezone.now,
+        db_index=True,
+    )
+
+    attempts = models.PositiveSmallIntegerField(
+        _('Attempts'),
+        default=0,
+    )
+
+    last_error = models.TextField(
+        _('Last error'),
+        blank=True,
+    )
+
+    sent = models.DateTimeField(
+        _('Sent'),
+        null=True,
+        default=None,
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = _('Outbox message')
+        verbose_name_plural = _('Outbox messages')
+
+    def __str__(self):
+        return '#{}: {}'.format(self.pk, self.subject)
+
+    def get_recipients(self):
+        """
+        :rtype: list[str]
+        """
+        return [recipient for recipient in self.recipients.splitlines() if recipient]
+
+
+class NotificationPreference(models.Model):
+    """
+    How a user wants to be notified about workflow actions.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='workflow_notification_preference',
+        verbose_name=_('User'),
+    )
+
+    digest = models.BooleanField(
+        _('Digest'),
+        default=False,
+        help_text=_('Collect notifications and receive them as one digest mail '
+                    '(sent by the send_workflow_digests command).'),
+    )
+
+    class Meta:
+        verbose_name = _('Notification preference')
+        verbose_name_plural = _('Notification preferences')
+
+    def __str__(self):
+        return '{}: {}'.format(self.user, _('digest') if self.digest else _('immediately'))
+
+
+class PendingNotification(models.Model):
+    """
+    A notification about an action held back for the next digest of a user.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('User'),
+    )
+
+    action = models.ForeignKey(
+        'workflows.Action',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Action'),
+    )
+
+    # `workflows.email.AUTHOR` or `workflows.email.EDITOR`
+    role = models.CharField(
+        _('Role'),
+        max_length=10,
+    )
+
+    created = models.DateTimeField(
+        _('Created'),
+        auto_now_add=True,
+    )
+
+    class Meta:
+        index_together = (('user', 'created'),)
+        verbose_name = _('Pending notification')
+        verbose_name_plural = _('Pending notifications')
+
+    def __str__(self):
+        return '{}: #{}'.format(self.user, self.action_id)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from .models import OutboxMessage
+
+
+def is_enabled():
+    """
+    Whether notification mails are queued in the outbox instead of being sent right away. The outbox
+    is drained by the `send_workflow_mails` command.
+
+    :rtype: bool
+    """
+    return getattr(settings, 'WORKFLOWS_MAIL_OUTBOX', False)
+
+
+def get_batch_size():
+    """
+    Maximum number of messages sent over one connection.
+
+    :rtype: int
+    """
+    return getattr(settings, 'WORKFLOWS_MAIL_BATCH_SIZE', 100)
+
+
+def queue(messages):
+    """
+    Queues the messages with a single insert, must be called in the transaction of the action they
+    notify about.
+
+    :type messages: list[django.core.mail.EmailMessage]
+    :rtype: list[OutboxMessage]
+    """
+    return OutboxMessage.objects.bulk_create([
+        OutboxMessage(subject=force_text(message.subject), body=message.body, recipients='\n'.join(message.to))
+        for message in messages
+    ])
+
+
+def send_batch(batch_size=None, max_attempts=5, backoff=60):
+    """
+    Sends up to `batch_size` due messages over a single connection. Failed messages are retried
+    after `backoff` seconds, doubled with every further attempt, until `max_attempts` is reached.
+    The batch is locked while it is sent so several workers do not send the same messages.
+
+    :return: the number of sent and failed messages
+    :rtype: (int, int)
+    """
+    batch_size = batch_size or get_batch_size()
+    now = timezone.now()
+    sent = failed = 0
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update().filter(
+                sent__isnull=True, send_after__lte=now, attempts__lt=max_attempts,
+            ).order_by('send_after', 'pk')[:batch_size]
+        )
+        if not messages:
+            return sent, failed
+
+        def retry_later(message, error):
+            message.send_after = now + timedelta(seconds=backoff * 2 ** (message.attempts - 1))
+            message.last_error = force_text(error)
+
+        mail_connection = get_connection()
+        # opened explicitly, otherwise every message would open and close a connection of its own
+        try:
+            mail_connection.open()
+        except Exception as e:
+            # an unreachable mail server fails the whole batch
+            for message in messages:
+                message.attempts += 1
+                retry_later(message, e)
+                message.save(update_fields=['attempts', 'send_after', 'last_error'])
+            return sent, len(messages)
+
+        try:
+            for message in messages:
+                message.attempts += 1
+                try:
+                    EmailMessage(
+                        subject=message.subject, body=message.body, to=message.get_recipients(),
+                        connection=mail_connection,
+                    ).send()
+                except Exception as e:
+                    retry_later(message, e)
+                    failed += 1
+                else:
+                    message.sent = timezone.now()
+                    sent += 1
+                message.save(update_fields=['attempts', 'send_after', 'last_error', 'sent'])
+        finally:
+            mail_connection.close()
+    return sent, failed
+
+
+def purge(days):
+    """
+    Deletes messages sent more than `days` days ago.
+
+    :rtype: int
+    """
+    messages = OutboxMessage.objects.filter(sent__lt=timezone.now() - timedelta(days=days))
+    count = messages.count()
+    messages.delete()
+    return count
@@ -1,27 +1,188 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import threading
+
+from cms.models import Page, Title
 from cms.operations import PUBLISH_PAGE_TRANSLATION
-from cms.signals import post_obj_operation
+from cms.signals import page_moved, post_obj_operation, post_publish, post_unpublish
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.sites.models import Site
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 
-from ..models import Action
+from .. import cache
+from ..models import Action, TitleWorkflowState, Workflow, WorkflowExtension, WorkflowIndex, WorkflowStage
+
+_deleted = threading.local()
 
 
 # @receiver(post_publish)  # cannot easily get user from this signal unfortunately
 @receiver(post_obj_operation)
 def close_moderation_request(sender, request=None, operation=None, translation=None, successful=None, **kwargs):
+    if operation != PUBLISH_PAGE_TRANSLATION or not successful:
+        return
+
     current_request = Action.get_current_request(translation)
+    if current_request is None:
+        return
+
+    if not current_request.is_publishable():
+        raise ValueError('Page is not publishable!')
+
+    Action.append(
+        title=translation,
+        workflow_id=current_request.workflow_id,
+        action_type=Action.PUBLISH,
+        user=request.user,
+        message=''
+    )
+
+
+@receiver(post_save, sender=WorkflowExtension)
+@receiver(post_delete, sender=WorkflowExtension)
+def update_extension_workflows(sender, instance=None, created=False, **kwargs):
+    try:
+        title = instance.extended_object
+        page = title.page
+    except (Title.DoesNotExist, Page.DoesNotExist):  # title is being deleted
+        cache.invalidate_title_workflows([instance.extended_object_id])
+        return
+    # a new extension not applying to descendants only affects its own title
+    subtree = not created or instance.descendants
+    title_ids = WorkflowIndex.rebuild(page=page, languages=[title.language], subtree=subtree)
+    deleted = get_deleted_titles()
+    if deleted:
+        # extensions are deleted before their titles, which must not be indexed again meanwhile
+        WorkflowIndex.objects.filter(title_id__in=deleted).delete()
+    cache.invalidate_title_workflows(title_ids)
+
+
+def get_deleted_titles():
+    """
+    Returns the pks of the titles being deleted in this thread.
+
+    :rtype: set
+    """
+    if not hasattr(_deleted, 'titles'):
+        _deleted.titles = set()
+    return _deleted.titles
+
+
+@receiver(pre_delete, sender=Title)
+def remember_deleted_title(sender, instance=None, **kwargs):
+    get_deleted_titles().add(instance.pk)
+
+
+@receiver(post_delete, sender=Title)
+def forget_deleted_title(sender, instance=None, **kwargs):
+    get_deleted_titles().discard(instance.pk)
+
+
+@receiver(post_save, sender=Title)
+def index_title_workflow(sender, instance=None, created=False, raw=False, **kwargs):
+    # new titles might inherit a workflow
+    if created and not raw:
+        WorkflowIndex.rebuild(page=instance.page, languages=[instance.language], subtree=False)
+
+
+@receiver(page_moved)
+def update_moved_workflows(sender, instance=None, **kwargs):
+    # inherited workflows of the whole subtree (draft and public) might have changed
+    for page in Page.objects.filter(pk__in=(instance.pk, instance.publisher_public_id)):
+        title_ids = WorkflowIndex.rebuild(page=page)
+        cache.invalidate_title_workflows(title_ids)
+        # and so did their urls
+        cache.invalidate_title_urls(title_ids)
+
+
+@receiver(pre_save, sender=Title)
+def remember_title_path(sender, instance=None, raw=False, update_fields=None, **kwargs):
+    if raw or instance.pk is None or (update_fields and not {'slug', 'path'} & set(update_fields)):
+        return
+    instance._workflows_old_path = Title.objects.filter(pk=instance.pk).values_list('path', flat=True).first()
+
+
+@receiver(post_save, sender=Title)
+def invalidate_title_urls(sender, instance=None, **kwargs):
+    old_path = instance.__dict__.pop('_workflows_old_path', None)
+    if old_path is None or old_path == instance.path:
+        return
+    # the paths of all descendants start with this one
+    title_ids = list(Title.objects.filter(
+        page__in=instance.page.get_descendants(), language=instance.language,
+    ).values_list('pk', flat=True))
+    cache.invalidate_title_urls([instance.pk] + title_ids)
+
+
+@receiver(post_save, sender=Site)
+def invalidate_site_urls(sender, raw=False, **kwargs):
+    if not raw:
+        cache.bump_version(cache.TITLE_URLS_VERSION)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidate_group_recipients(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        # the user's groups are gone after clearing
+        instance._workflows_groups = list(instance.groups.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        group_ids = [instance.pk]
+    elif action == 'post_clear':
+        group_ids = instance.__dict__.pop('_workflows_groups', [])
+    else:
+        group_ids = pk_set
+    cache.invalidate_group_recipients(group_ids)
+
+
+@receiver(pre_delete, sender=get_user_model())
+def remember_user_groups(sender, instance=None, **kwargs):
+    # memberships are deleted before the user
+    instance._workflows_groups = list(instance.groups.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_recipients(sender, instance=None, created=False, update_fields=None, **kwargs):
+    # new users are not in any group yet and logging in only updates `last_login`
+    if created or (update_fields and not {'email', 'is_active'} & set(update_fields)):
+        return
+    group_ids = instance.__dict__.pop('_workflows_groups', None)
+    if group_ids is None:
+        group_ids = instance.groups.values_list('pk', flat=True)
+    cache.invalidate_group_recipients(group_ids)
+
+
+@receiver(post_save, sender=WorkflowStage)
+@receiver(post_delete, sender=WorkflowStage)
+def invalidate_stage_graph(sender, instance=None, raw=False, **kwargs):
+    cache.bump_version(WorkflowStage.graph_key(instance.workflow_id))
+    if not raw:
+        # open requests might have more, fewer or other stages left
+        TitleWorkflowState.refresh_workflow(instance.workflow_id)
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_stage_graphs(sender, instance=None, created=False, **kwargs):
+    # stage graphs hold their stages' groups
+    if created:
+        return
+    for workflow_id in WorkflowStage.objects.filter(group=instance).values_list('workflow_id', flat=True):
+        cache.bump_version(WorkflowStage.graph_key(workflow_id))
+
+
+@receiver(post_delete, sender=Workflow)
+def invalidate_default_workflow(sender, instance=None, **kwargs):
+    cache.bump_version(Workflow.DEFAULT_WORKFLOW_KEY)
+
 
-    if all((operation == PUBLISH_PAGE_TRANSLATION, successful, current_request)):
-        if not current_request.is_publishable():
-            raise ValueError('Page is not publishable!')
-
-        current_action = current_request.last_action()
-        current_request.last_action().add_child(
-            title=translation,
-            workflow=current_action.workflow,
-            action_type=Action.PUBLISH,
-            user=request.user,
-            message=''
-        )
+@receiver(post_publish)
+@receiver(post_unpublish)
+def invalidate_public_diff(sender, instance=None, language=None, **kwargs):
+    # cached renderings of the public page are outdated
+    if instance.publisher_public_id:
+        cache.bump_version(cache.public_diff_version_key(instance.publisher_public_id, language))
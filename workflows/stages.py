@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+
+class StageGraph(object):
+    """
+    Compiled, immutable navigation graph of a workflow's stages. All navigation is precomputed
+    from the ordered stages, so it does not need any database access. Stages can be passed as
+    `WorkflowStage` instances or pks, `None` refers to the start of the workflow (the request).
+
+    Instances are shared between threads (see `WorkflowStage.get_graph`) and must not be modified.
+    """
+
+    def __init__(self, stages):
+        """
+        :param stages: the workflow's stages in order with their groups
+        :type stages: list[workflows.models.WorkflowStage]
+        """
+        self.stages = tuple(stages)
+        self.mandatory_stages = tuple(stage for stage in self.stages if not stage.optional)
+        self._positions = {stage.pk: position for position, stage in enumerate(self.stages)}
+
+        # index 0 is the start of the workflow, index i + 1 is stage i
+        self._next_mandatory = [None] * (len(self.stages) + 1)
+        self._possible_next = [()] * (len(self.stages) + 1)
+        next_mandatory = None
+        for position in reversed(range(len(self.stages) + 1)):
+            self._next_mandatory[position] = next_mandatory
+            end = len(self.stages) if next_mandatory is None else self._positions[next_mandatory.pk] + 1
+            self._possible_next[position] = self.stages[position:end]
+            if position and not self.stages[position - 1].optional:
+                next_mandatory = self.stages[position - 1]
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def _index(self, stage):
+        if stage is None:
+            return 0
+        position = self._positions.get(getattr(stage, 'pk', stage))
+        return None if position is None else position + 1
+
+    def get(self, pk):
+        """
+        :rtype: workflows.models.WorkflowStage | None
+        """
+        position = self._positions.get(pk)
+        return None if position is None else self.stages[position]
+
+    @property
+    def first_mandatory_stage(self):
+        return self._next_mandatory[0]
+
+    def next_mandatory_stage(self, stage=None):
+        """
+        Returns the first mandatory stage after `stage` or `None` if there is none.
+        """
+        index = self._index(stage)
+        return None if index is None else self._next_mandatory[index]
+
+    def possible_next_stages(self, stage=None):
+        """
+        Returns all stages that can follow `stage`, i.e. all stages after `stage` up to and
+        including the next mandatory stage.
+
+        :rtype: tuple
+        """
+        index = self._index(stage)
+        return () if index is None else self._possible_next[index]
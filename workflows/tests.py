@@ -1,3 +1,846 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
 
-# Create your tests here.
+import socket
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from cms.api import add_plugin, create_page
+from cms.models import Page, Title
+from cms.utils.conf import get_cms_setting
+from cms.utils.urlutils import admin_reverse
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
+
+from . import cache, diff, outbox
+from .context import WorkflowContext
+from .email import EDITOR, get_absolute_url, send_action_mails, send_digests
+from .models import (
+    Action, ActionConflict, DiffSnapshot, NotificationPreference, OutboxMessage, PendingNotification,
+    TitleWorkflowState, Workflow, WorkflowExtension, WorkflowIndex, WorkflowStage,
+)
+from .views import DiffView
+
+# stands in for a downcast plugin where only the type matters
+FakePlugin = namedtuple('FakePlugin', ('plugin_type',))
+
+
+class WorkflowTestCase(TestCase):
+    """
+    Sets up a default workflow of two mandatory stages and a page to run it on.
+    """
+
+    def setUp(self):
+        # cached lookups must not outlive the rows of a previous test
+        cache.get_cache().clear()
+        self.language = settings.LANGUAGES[0][0]
+        self.template = get_cms_setting('TEMPLATES')[0][0]
+        user_model = get_user_model()
+        self.author = user_model.objects.create_user('author', 'author@example.com', 'secret')
+        self.editor = user_model.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.workflow = self.create_workflow('Default', default=True)
+        self.title = self.get_title(self.create_page('Page'))
+
+    def create_workflow(self, name, default=False, stages=2):
+        workflow = Workflow.objects.create(name=name, default=default)
+        for order in range(stages):
+            group = Group.objects.create(name='{} {}'.format(name, order))
+            group.user_set.add(self.editor)
+            WorkflowStage.objects.create(workflow=workflow, group=group, order=order)
+        return workflow
+
+    def create_page(self, name, parent=None):
+        return create_page(name, self.template, self.language, parent=parent).reload()
+
+    def get_title(self, page):
+        return page.title_set.get(language=self.language)
+
+    @property
+    def stages(self):
+        return list(self.workflow.stages.order_by('order'))
+
+    def append(self, action_type, title=None, stage=None, version=None):
+        return Action.append(
+            title=title or self.title, version=version, workflow=self.workflow, action_type=action_type,
+            stage=stage, group=stage.group if stage else None,
+            user=self.author if action_type == Action.REQUEST else self.editor, message='',
+        )
+
+    def get_state(self, title=None):
+        return TitleWorkflowState.objects.get(pk=(title or self.title).pk)
+
+    def login_admin(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+
+
+class TitleWorkflowStateTest(WorkflowTestCase):
+
+    def test_track(self):
+        first, second = self.stages
+
+        request = self.append(Action.REQUEST)
+        state = self.get_state()
+        self.assertEqual(
+            (state.request_id, state.last_action_id, state.status, state.next_stage_id, state.version),
+            (request.pk, request.pk, Action.REQUESTED, first.pk, 1),
+        )
+
+        approval = self.append(Action.APPROVE, stage=first, version=state.version)
+        state = self.get_state()
+        self.assertEqual(
+            (state.request_id, state.last_action_id, state.status, state.next_stage_id, state.version),
+            (request.pk, approval.pk, Action.REQUESTED, second.pk, 2),
+        )
+
+        approval = self.append(Action.APPROVE, stage=second, version=state.version)
+        state = self.get_state()
+        self.assertEqual(
+            (state.request_id, state.last_action_id, state.status, state.next_stage_id, state.version),
+            (request.pk, approval.pk, Action.APPROVED, None, 3),
+        )
+        self.assertEqual(Action.objects.get(pk=request.pk).last_action(), approval)
+
+    def test_stage_changes(self):
+        first, second = self.stages
+        request = self.append(Action.REQUEST)
+        self.append(Action.APPROVE, stage=first)
+        self.append(Action.APPROVE, stage=second)
+        version = self.get_state().version
+
+        third = WorkflowStage.objects.create(
+            workflow=self.workflow, group=Group.objects.create(name='Default 2'), order=2,
+        )
+        state = self.get_state()
+        self.assertEqual(
+            (state.status, state.next_stage_id, state.stage_order_min, state.stage_order_max, state.version),
+            (Action.REQUESTED, third.pk, second.order, third.order, version + 1),
+        )
+        self.assertEqual(Action.objects.get(pk=request.pk).status, state.status)
+
+        third.optional = True
+        third.save()
+        state = self.get_state()
+        self.assertEqual((state.status, state.next_stage_id, state.version), (Action.APPROVED, None, version + 2))
+        self.assertEqual(Action.objects.get(pk=request.pk).status, state.status)
+
+        # nothing changes for the request
+        third.delete()
+        self.assertEqual(self.get_state().version, version + 2)
+
+
+class InboxTest(WorkflowTestCase):
+
+    def test_inbox(self):
+        first, second = self.stages
+        reviewer = get_user_model().objects.create_user('reviewer', 'reviewer@example.com', 'secret')
+        second.group.user_set.add(reviewer)
+
+        def inbox(user):
+            return [state.pk for state in TitleWorkflowState.inbox(user)]
+
+        self.assertEqual(inbox(self.editor), [])
+        self.append(Action.REQUEST)
+        self.assertEqual((inbox(self.editor), inbox(reviewer)), ([self.title.pk], []))
+
+        approval = self.append(Action.APPROVE, stage=first)
+        self.assertEqual((inbox(self.editor), inbox(reviewer)), ([self.title.pk], [self.title.pk]))
+        self.assertEqual(Action.requiring_action(reviewer), [approval])
+
+        self.append(Action.APPROVE, stage=second)
+        self.assertEqual((inbox(self.editor), inbox(reviewer)), ([], []))
+
+
+class WorkflowCacheTest(WorkflowTestCase):
+
+    def test_extension_changes(self):
+        other = self.create_workflow('Other')
+        child = self.get_title(self.create_page('Child', parent=self.title.page))
+        self.assertEqual((Workflow.get_workflow(self.title), Workflow.get_workflow(child)), (self.workflow, self.workflow))
+        self.assertEqual(cache.get_title_workflow_id(child.pk), cache.DEFAULT_WORKFLOW)
+
+        extension = WorkflowExtension.objects.create(extended_object=self.title, workflow=other, descendants=True)
+        self.assertEqual((Workflow.get_workflow(self.title), Workflow.get_workflow(child)), (other, other))
+        self.assertEqual(cache.get_title_workflow_id(child.pk), other.pk)
+
+        extension.descendants = False
+        extension.save()
+        self.assertEqual((Workflow.get_workflow(self.title), Workflow.get_workflow(child)), (other, self.workflow))
+
+        extension.delete()
+        self.assertEqual((Workflow.get_workflow(self.title), Workflow.get_workflow(child)), (self.workflow, self.workflow))
+
+    def test_memoized_per_request(self):
+        cache.start_memo()
+        try:
+            Workflow.get_workflow(self.title)
+            with self.assertNumQueries(0):
+                Workflow.get_workflow(self.title)
+        finally:
+            cache.clear_memo()
+
+
+class WorkflowIndexTest(WorkflowTestCase):
+
+    def get_index(self, title_ids):
+        entries = WorkflowIndex.objects.filter(title_id__in=title_ids)
+        return {
+            title_id: (workflow_id, source_id)
+            for title_id, workflow_id, source_id in entries.values_list('title_id', 'workflow_id', 'source_id')
+        }
+
+    def test_build_workflow_index(self):
+        root = self.create_page('Root')
+        child = self.create_page('Child', parent=root)
+        grandchild = self.create_page('Grandchild', parent=child)
+        root_title, child_title, grandchild_title = [self.get_title(page) for page in (root, child, grandchild)]
+        inherited, own = self.create_workflow('Inherited'), self.create_workflow('Own')
+        WorkflowExtension.objects.create(extended_object=root_title, workflow=inherited, descendants=True)
+        WorkflowExtension.objects.create(extended_object=child_title, workflow=own, descendants=False)
+
+        expected = {
+            root_title.pk: (inherited.pk, root_title.pk),
+            child_title.pk: (own.pk, child_title.pk),
+            grandchild_title.pk: (inherited.pk, root_title.pk),
+        }
+        # maintained by the signal handlers
+        self.assertEqual(self.get_index(expected), expected)
+
+        WorkflowIndex.objects.all().delete()
+        WorkflowIndex.rebuild()
+        self.assertEqual(self.get_index(expected), expected)
+        # titles without a workflow of their own or inherited are not indexed
+        self.assertEqual(self.get_index([self.title.pk]), {})
+
+        # a subtree keeps the workflows inherited from above
+        WorkflowIndex.objects.all().delete()
+        title_ids = WorkflowIndex.rebuild(page=child)
+        self.assertEqual(set(title_ids), {child_title.pk, grandchild_title.pk})
+        self.assertEqual(self.get_index(expected), {pk: expected[pk] for pk in title_ids})
+
+        self.assertEqual(Workflow.get_workflow(grandchild_title), inherited)
+        self.assertEqual(Workflow.get_workflow(self.title), self.workflow)
+
+    def test_delete_page(self):
+        root = self.create_page('Root')
+        child = self.create_page('Child', parent=root)
+        grandchild = self.create_page('Grandchild', parent=child)
+        root_title, child_title, grandchild_title = [self.get_title(page) for page in (root, child, grandchild)]
+        WorkflowExtension.objects.create(
+            extended_object=root_title, workflow=self.create_workflow('Inherited'), descendants=True,
+        )
+        WorkflowExtension.objects.create(extended_object=child_title, workflow=self.create_workflow('Own'))
+
+        Page.objects.get(pk=child.pk).delete()
+        self.assertFalse(WorkflowIndex.objects.filter(title_id__in=(child_title.pk, grandchild_title.pk)).exists())
+        self.assertTrue(WorkflowIndex.objects.filter(title_id=root_title.pk).exists())
+
+    def test_move_page(self):
+        inheriting, other = self.create_page('Inheriting'), self.create_page('Other')
+        child = self.create_page('Child', parent=inheriting)
+        inherited = self.create_workflow('Inherited')
+        WorkflowExtension.objects.create(extended_object=self.get_title(inheriting), workflow=inherited, descendants=True)
+        self.assertEqual(Workflow.get_workflow(self.get_title(child)), inherited)
+
+        child.move_page(other.reload(), 'last-child')
+        self.assertEqual(Workflow.get_workflow(self.get_title(child)), self.workflow)
+        self.assertFalse(WorkflowIndex.objects.filter(title_id=self.get_title(child).pk).exists())
+
+
+class StageGraphTest(WorkflowTestCase):
+
+    def test_navigation(self):
+        workflow = Workflow.objects.create(name='Mixed')
+        for order, optional in enumerate((True, False, True, True, False, True)):
+            WorkflowStage.objects.create(
+                workflow=workflow, group=Group.objects.create(name='Mixed {}'.format(order)), order=order,
+                optional=optional,
+            )
+        stages = workflow.stages.order_by('order')
+        mandatory = stages.filter(optional=False)
+        graph = WorkflowStage.get_graph(workflow.pk)
+
+        # the navigation of the stage querysets the graph replaces
+        first = mandatory.first()
+        self.assertEqual(graph.first_mandatory_stage, first)
+        self.assertEqual(list(graph.possible_next_stages()), list(stages.filter(order__lte=first.order)))
+        for stage in stages:
+            next_mandatory = mandatory.filter(order__gt=stage.order).first()
+            possible = stages.filter(order__gt=stage.order)
+            if next_mandatory is not None:
+                possible = possible.filter(order__lte=next_mandatory.order)
+            self.assertEqual(graph.next_mandatory_stage(stage), next_mandatory)
+            self.assertEqual(list(graph.possible_next_stages(stage.pk)), list(possible))
+
+        with self.assertNumQueries(0):
+            WorkflowStage.get_graph(workflow.pk)
+
+    def test_rebuilt_on_changes(self):
+        first, second = self.stages
+        graph = WorkflowStage.get_graph(self.workflow.pk)
+        second.optional = True
+        second.save()
+        self.assertIsNot(WorkflowStage.get_graph(self.workflow.pk), graph)
+        self.assertIsNone(WorkflowStage.get_graph(self.workflow.pk).next_mandatory_stage(first))
+
+    @override_settings(WORKFLOWS_LOCAL_CACHE_TIMEOUT=-1)
+    def test_local_timeout(self):
+        graph = WorkflowStage.get_graph(self.workflow.pk)
+        self.assertIsNot(WorkflowStage.get_graph(self.workflow.pk), graph)
+
+
+class WorkflowContextTest(WorkflowTestCase):
+
+    def get_context(self, request):
+        return WorkflowContext.for_request(request, self.title.page, self.language)
+
+    def test_shared_per_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.editor
+        context = self.get_context(request)
+        self.assertIs(self.get_context(request), context)
+        self.assertIsNot(WorkflowContext.for_request(request, self.title.page, 'xx'), context)
+
+        self.assertEqual((context.title, context.workflow), (self.title, self.workflow))
+        self.assertEqual((context.current_request, context.editable, context.publishable), (None, True, False))
+        with self.assertNumQueries(0):
+            self.get_context(request).editable
+
+    def test_open_request(self):
+        first, second = self.stages
+        request = self.append(Action.REQUEST)
+        self.append(Action.APPROVE, stage=first)
+        http_request = RequestFactory().get('/')
+        http_request.user = self.editor
+
+        context = self.get_context(http_request)
+        self.assertEqual(context.current_request, request)
+        self.assertEqual(context.next_stage, second)
+        self.assertEqual((context.editable, context.publishable), (False, False))
+
+
+class BatchResolutionTest(WorkflowTestCase):
+
+    def test_get_workflows(self):
+        child = self.get_title(self.create_page('Child', parent=self.title.page))
+        other = self.get_title(self.create_page('Other'))
+        own = self.create_workflow('Own')
+        WorkflowExtension.objects.create(extended_object=self.title, workflow=own, descendants=True)
+        titles = [self.title, child, other]
+
+        with self.assertNumQueries(2):
+            workflows = Workflow.get_workflows(titles)
+        self.assertEqual(workflows, {title: Workflow.get_workflow(title) for title in titles})
+        self.assertEqual(workflows, {self.title: own, child: own, other: self.workflow})
+
+    def test_get_states(self):
+        other = self.get_title(self.create_page('Other'))
+        request = self.append(Action.REQUEST)
+        cache.start_memo()
+        try:
+            states = Action.get_states([self.title, other])
+            # the workflows are memoized and the states cached on the titles
+            with self.assertNumQueries(0):
+                self.assertEqual(Action.get_current_request(self.title), request)
+                self.assertIsNone(Action.get_current_request(other))
+        finally:
+            cache.clear_memo()
+        self.assertEqual(states, {self.title: self.get_state(), other: None})
+
+
+class DefaultWorkflowTest(WorkflowTestCase):
+
+    def test_cached(self):
+        self.assertEqual(Workflow.default_workflow(), self.workflow)
+        with self.assertNumQueries(0):
+            Workflow.default_workflow()
+
+    def test_invalidated(self):
+        self.assertEqual(Workflow.get_workflow(self.title), self.workflow)
+        other = self.create_workflow('Other', default=True)
+        self.assertEqual(Workflow.default_workflow(), other)
+        # titles cache that they use the default workflow, not which one
+        self.assertEqual(Workflow.get_workflow(self.title), other)
+
+        other.delete()
+        self.assertIsNone(Workflow.default_workflow())
+        self.assertIsNone(Workflow.get_workflow(self.title))
+
+
+class WithStatusTest(WorkflowTestCase):
+
+    def build_chains(self):
+        first, second = self.stages
+        self.append(Action.REQUEST)
+        self.append(Action.CANCEL)
+        self.append(Action.REQUEST)
+        self.append(Action.APPROVE, stage=first)
+        self.append(Action.REJECT, stage=second)
+        self.append(Action.REQUEST)
+        self.append(Action.APPROVE, stage=first)
+        self.append(Action.APPROVE, stage=second)
+        self.append(Action.PUBLISH)
+        self.append(Action.REQUEST)
+        self.append(Action.APPROVE, stage=first)
+        self.append(Action.REQUEST, title=self.get_title(self.create_page('Other')))
+
+    def assertStatusMatches(self):
+        requests = list(Action.objects.filter(depth=1).with_status())
+        self.assertEqual(len(requests), 5)
+        for request in requests:
+            fresh = Action.objects.get(pk=request.pk)
+            last_action = fresh.last_action()
+            next_stage = last_action.next_mandatory_stage()
+            self.assertEqual(
+                (request.last_action_id, request.last_action_type, request.next_stage_id, request.status),
+                (last_action.pk, last_action.action_type, next_stage.pk if next_stage else None, fresh.status),
+            )
+        self.assertEqual(Action.objects.filter(depth=1).with_status().filter(status=Action.REQUESTED).count(), 2)
+
+    def test_with_status(self):
+        self.build_chains()
+        self.assertStatusMatches()
+
+    @override_settings(WORKFLOWS_ACTION_STORAGE=Action.FLAT_STORAGE)
+    def test_with_status_flat(self):
+        self.build_chains()
+        self.assertStatusMatches()
+
+
+class ActionAdminTest(WorkflowTestCase):
+
+    def get_changelist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:workflows_action_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries(self):
+        self.login_admin()
+        self.append(Action.REQUEST)
+        num_queries = self.get_changelist()
+
+        for name in ('First', 'Second', 'Third'):
+            title = self.get_title(self.create_page(name))
+            self.append(Action.REQUEST, title=title)
+            self.append(Action.APPROVE, title=title, stage=self.stages[0])
+        # the number of queries does not depend on the number of requests
+        self.assertEqual(self.get_changelist(), num_queries)
+
+
+class DiffCacheTest(WorkflowTestCase):
+
+    def get_public_cache_keys(self):
+        view = DiffView(language=self.language)
+        public = Page.objects.get(pk=self.title.page.publisher_public_id)
+        return [view.get_public_cache_key(public, placeholder) for placeholder in public.rescan_placeholders().values()]
+
+    def test_public_cache_key(self):
+        page = self.title.page
+        page.publish(self.language)
+        keys = self.get_public_cache_keys()
+        self.assertTrue(keys)
+        self.assertEqual(self.get_public_cache_keys(), keys)
+
+        page.reload().publish(self.language)
+        self.assertFalse(set(self.get_public_cache_keys()) & set(keys))
+
+
+class ConcurrentDiffTest(SimpleTestCase):
+
+    def test_diff_slots(self):
+        slots = {
+            'small': ('<p>Public</p>', '<p>Draft</p>'),
+            'large': ('<p>{}</p>'.format('Public ' * 100), '<p>{}</p>'.format('Draft ' * 100)),
+        }
+        expected = diff.diff_slots(slots)
+        self.assertEqual(diff.diff_slots(slots, workers=2, process_threshold=1000), expected)
+        # the pool is shared by all diffs of this process
+        pool = diff.get_pool(ProcessPoolExecutor, 2)
+        self.assertEqual(diff.diff_slots(slots, workers=2, process_threshold=1000), expected)
+        self.assertIs(diff.get_pool(ProcessPoolExecutor, 2), pool)
+
+    def test_unfinished_tasks_are_cancelled(self):
+        started = []
+        release = threading.Event()
+
+        def task(key):
+            def run():
+                started.append(key)
+                release.wait(5)
+                return key
+            return run
+
+        results = diff.run_in_threads({key: task(key) for key in range(3)}, 1, diff.Deadline(0.1))
+        release.set()
+        self.assertEqual(results, {})
+        # the queued tasks never start
+        self.assertEqual(diff.run_in_threads({'last': lambda: 'last'}, 1, diff.Deadline()), {'last': 'last'})
+        self.assertEqual(len(started), 1)
+
+
+class HtmlDiffTest(SimpleTestCase):
+
+    def test_slot_states(self):
+        public = OrderedDict([
+            ('same', '<p>Same</p>'), ('changed', '<p>Old</p>'), ('removed', '<p>Gone</p>'), ('late', '<p>Late</p>'),
+        ])
+        draft = OrderedDict([
+            ('same', '<p>Same</p>'), ('changed', '<p>New</p>'), ('late', None), ('added', '<p>Added</p>'),
+        ])
+        view = DiffView(language='en', request=None)
+        view.deadline = diff.Deadline()
+        view.render_pages = lambda *args: (public, draft)
+
+        diffs = view.get_html_diffs(None, None)
+        self.assertEqual([(slot_diff.slot, slot_diff.state) for slot_diff in diffs], [
+            ('same', diff.UNCHANGED), ('changed', diff.CHANGED), ('removed', diff.REMOVED), ('late', diff.TIMEOUT),
+            ('added', diff.ADDED),
+        ])
+        # unchanged slots are shown as they are without being diffed
+        self.assertEqual(diffs[0].html, '<p>Same</p>')
+        self.assertIn('<ins>New</ins>', diffs[1].html)
+        self.assertIn('<ins>Added</ins>', diffs[4].html)
+
+
+class AlignPluginsTest(SimpleTestCase):
+
+    def align(self, public, draft):
+        def nodes(plugins):
+            return [diff.PluginNode(FakePlugin(plugin_type), digest, []) for plugin_type, digest in plugins]
+
+        return [
+            (change.state, change.public and change.public.digest, change.draft and change.draft.digest)
+            for change in diff.align_plugins(nodes(public), nodes(draft))
+        ]
+
+    def test_moved(self):
+        public = [('Text', 'a'), ('Picture', 'b'), ('Link', 'c')]
+        draft = [('Text', 'a'), ('Link', 'c'), ('Picture', 'b')]
+        self.assertEqual(self.align(public, draft), [
+            (diff.UNCHANGED, 'a', 'a'), (diff.MOVED, 'c', 'c'), (diff.UNCHANGED, 'b', 'b'),
+        ])
+
+    def test_changed(self):
+        # only plugins of the same type are compared, others are replaced
+        public = [('Text', 'a'), ('Text', 'b'), ('Picture', 'c')]
+        draft = [('Text', 'a'), ('Text', 'x'), ('Link', 'y')]
+        self.assertEqual(self.align(public, draft), [
+            (diff.UNCHANGED, 'a', 'a'), (diff.CHANGED, 'b', 'x'), (diff.REMOVED, 'c', None), (diff.ADDED, None, 'y'),
+        ])
+
+    def test_draft_only(self):
+        self.assertEqual(self.align([], [('Text', 'a')]), [(diff.ADDED, None, 'a')])
+
+
+@override_settings(WORKFLOWS_DIFF_SNAPSHOT_ASYNC=False)
+class DiffSnapshotTest(WorkflowTestCase):
+
+    def test_capture(self):
+        page = self.title.page
+        placeholder = list(page.rescan_placeholders().values())[0]
+        page.publish(self.language)
+        add_plugin(placeholder, 'TextPlugin', self.language, body='<p>Hello</p>')
+        request = self.append(Action.REQUEST)
+
+        DiffView.capture(page.pk, self.language, request.pk, self.author.pk)
+        diffs = {slot_diff.slot: slot_diff for slot_diff in DiffSnapshot.objects.get(request=request).get_diffs()}
+        self.assertEqual(diffs[placeholder.slot].state, diff.CHANGED)
+        self.assertIn('Hello', diffs[placeholder.slot].html)
+
+    def test_pack(self):
+        diffs = [diff.SlotDiff('content', diff.CHANGED, '<ins>Ä</ins>'), diff.SlotDiff('sidebar', diff.UNCHANGED, '')]
+        self.assertEqual(diff.unpack(diff.pack(diffs)), diffs)
+
+
+class StreamingDiffTest(WorkflowTestCase):
+
+    def test_stream(self):
+        self.login_admin()
+        page = self.title.page
+        placeholder = list(page.rescan_placeholders().values())[0]
+        page.publish(self.language)
+        add_plugin(placeholder, 'TextPlugin', self.language, body='<p>Hello</p>')
+
+        with translation.override(self.language):
+            url = admin_reverse('workflow_diff', args=[page.pk, self.language])
+        response = self.client.get(url, {'stream': 1})
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('Hello', content)
+        self.assertNotIn(DiffView.STREAM_MARKER, content)
+
+
+class TextDiffTest(WorkflowTestCase):
+
+    def test_diff_text(self):
+        self.assertEqual(
+            diff.diff_text(['Same line', 'Old text here', 'Gone'], ['Same line', 'New text here', 'Added']),
+            '<p>Same line</p><p><del>Old</del> <ins>New</ins> text here <del>Gone</del> <ins>Added</ins></p>',
+        )
+        self.assertEqual(diff.diff_text(['Kept'], ['Kept', 'New']), '<p>Kept</p><p><ins>New</ins></p>')
+        self.assertEqual(diff.diff_words('a <b> c', 'a <b> d'), 'a &lt;b&gt; <del>c</del> <ins>d</ins>')
+
+    def test_title_diffs(self):
+        page = self.title.page
+        page.publish(self.language)
+        Title.objects.filter(pk=self.title.pk).update(title='Changed', meta_description='New description')
+
+        view = DiffView(language=self.language)
+        self.assertEqual(view.get_title_diffs(page.reload()), [
+            (Title._meta.get_field('title').verbose_name, '<del>Page</del> <ins>Changed</ins>'),
+            (Title._meta.get_field('meta_description').verbose_name, '<ins>New description</ins>'),
+        ])
+
+
+@override_settings(WORKFLOWS_DIFF_SNAPSHOTS=False)
+class ActionViewTest(WorkflowTestCase):
+
+    def post_request(self):
+        self.login_admin()
+        with translation.override(self.language):
+            url = admin_reverse('workflow_request', args=[self.title.page.pk, self.language])
+        response = self.client.post(url, {'message_': 'Please review', 'version_': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_state().status, Action.REQUESTED)
+
+    def test_mails_sent_after_response(self):
+        self.post_request()
+        self.assertEqual([message.to for message in mail.outbox], [['editor@example.com']])
+
+    @override_settings(WORKFLOWS_MAIL_OUTBOX=True)
+    def test_mails_queued(self):
+        self.post_request()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(list(OutboxMessage.objects.values_list('recipients', flat=True)), ['editor@example.com'])
+
+
+class NotificationTest(WorkflowTestCase):
+
+    def test_one_message_per_recipient(self):
+        reviewer = get_user_model().objects.create_user('reviewer', 'reviewer@example.com', 'secret')
+        self.stages[0].group.user_set.add(reviewer)
+        request = self.append(Action.REQUEST)
+
+        self.assertTrue(send_action_mails(request))
+        self.assertEqual(
+            sorted(message.to for message in mail.outbox), [['editor@example.com'], ['reviewer@example.com']],
+        )
+        self.assertEqual(len({message.body for message in mail.outbox}), 1)
+
+    def test_postpone(self):
+        NotificationPreference.objects.create(user=self.editor, digest=True)
+        request = self.append(Action.REQUEST)
+        self.assertFalse(send_action_mails(request))
+        self.assertEqual(mail.outbox, [])
+        pending = PendingNotification.objects.values_list('user', 'action', 'role')
+        self.assertEqual(list(pending), [(self.editor.pk, request.pk, EDITOR)])
+
+    def test_send_digests(self):
+        NotificationPreference.objects.create(user=self.editor, digest=True)
+        send_action_mails(self.append(Action.REQUEST))
+        send_action_mails(self.append(Action.APPROVE, stage=self.stages[0]))
+        # the author is notified of the approval right away
+        self.assertEqual([message.to for message in mail.outbox], [['author@example.com']])
+
+        self.assertEqual(send_digests(), 1)
+        self.assertEqual([message.to for message in mail.outbox[1:]], [['editor@example.com']])
+        self.assertFalse(PendingNotification.objects.exists())
+        self.assertEqual(send_digests(), 0)
+
+
+class NotificationCacheTest(WorkflowTestCase):
+
+    def test_recipients(self):
+        stage = self.stages[0]
+        self.assertEqual(stage.get_recipients(), [(self.editor.pk, 'editor@example.com')])
+        with self.assertNumQueries(0):
+            stage.get_recipients()
+
+        reviewer = get_user_model().objects.create_user('reviewer', 'reviewer@example.com', 'secret')
+        stage.group.user_set.add(reviewer)
+        self.assertEqual(stage.get_recipients(), [
+            (self.editor.pk, 'editor@example.com'), (reviewer.pk, 'reviewer@example.com'),
+        ])
+        reviewer.groups.remove(stage.group)
+        self.assertEqual(stage.get_recipients(), [(self.editor.pk, 'editor@example.com')])
+
+        self.editor.email = 'changed@example.com'
+        self.editor.save()
+        self.assertEqual(stage.get_recipients(), [(self.editor.pk, 'changed@example.com')])
+        self.editor.groups.clear()
+        self.assertEqual(stage.get_recipients(), [])
+
+    def test_urls(self):
+        child = self.get_title(self.create_page('Child', parent=self.title.page))
+        url = get_absolute_url(child)
+        fresh = Title.objects.get(pk=child.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_absolute_url(fresh), url)
+
+        # the path is updated from the slug
+        child.slug = 'renamed'
+        child.save()
+        self.assertTrue(get_absolute_url(Title.objects.get(pk=child.pk)).rstrip('/').endswith('/renamed'))
+
+        site = Site.objects.get_current()
+        site.domain = 'example.org'
+        site.save()
+        self.assertTrue(get_absolute_url(Title.objects.get(pk=child.pk)).startswith('http://example.org/'))
+
+class FakeConnection(object):
+    """
+    Mail connection failing to open or refusing the given recipients.
+    """
+
+    def __init__(self, fail_open=False, refuse=()):
+        self.fail_open = fail_open
+        self.refuse = set(refuse)
+        self.sent = []
+
+    def open(self):
+        if self.fail_open:
+            raise socket.error('Connection refused')
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.refuse & set(message.to):
+                raise socket.error('Recipient refused')
+            self.sent.append(message)
+        return len(messages)
+
+
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        self.messages = [
+            OutboxMessage.objects.create(
+                subject='Subject {}'.format(number), body='Body', recipients='user{}@example.com'.format(number),
+            )
+            for number in range(3)
+        ]
+
+    def send_batch(self, connection, **kwargs):
+        with mock.patch('workflows.outbox.get_connection', return_value=connection):
+            return outbox.send_batch(**kwargs)
+
+    def test_send_batch(self):
+        connection = FakeConnection()
+        self.assertEqual(self.send_batch(connection), (3, 0))
+        self.assertEqual([message.to for message in connection.sent], [
+            ['user0@example.com'], ['user1@example.com'], ['user2@example.com'],
+        ])
+        self.assertFalse(OutboxMessage.objects.filter(sent__isnull=True).exists())
+        self.assertEqual(self.send_batch(connection), (0, 0))
+
+    def test_failed_message_is_retried(self):
+        self.assertEqual(self.send_batch(FakeConnection(refuse=['user1@example.com']), backoff=60), (2, 1))
+        failed = OutboxMessage.objects.get(pk=self.messages[1].pk)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIsNone(failed.sent)
+        self.assertIn('Recipient refused', failed.last_error)
+        self.assertGreater(failed.send_after, timezone.now() + timedelta(seconds=30))
+
+        # not due yet
+        self.assertEqual(self.send_batch(FakeConnection()), (0, 0))
+        OutboxMessage.objects.filter(pk=failed.pk).update(send_after=timezone.now())
+        self.assertEqual(self.send_batch(FakeConnection()), (1, 0))
+
+    def test_unreachable_server_fails_batch(self):
+        self.assertEqual(self.send_batch(FakeConnection(fail_open=True), backoff=60), (0, 3))
+        for message in OutboxMessage.objects.all():
+            self.assertEqual(message.attempts, 1)
+            self.assertIsNone(message.sent)
+            self.assertIn('Connection refused', message.last_error)
+            self.assertGreater(message.send_after, timezone.now() + timedelta(seconds=30))
+
+    def test_max_attempts(self):
+        refuse = [message.recipients for message in self.messages]
+        self.assertEqual(self.send_batch(FakeConnection(refuse=refuse), max_attempts=1), (0, 3))
+        OutboxMessage.objects.update(send_after=timezone.now())
+        self.assertEqual(self.send_batch(FakeConnection(), max_attempts=1), (0, 0))
+
+
+
+class ActionConflictTest(WorkflowTestCase):
+
+    def test_append_conflicts(self):
+        first = self.stages[0]
+
+        self.append(Action.REQUEST)
+        with self.assertRaises(ActionConflict):
+            self.append(Action.REQUEST)
+
+        version = self.get_state().version
+        self.append(Action.APPROVE, stage=first, version=version)
+        # another reviewer deciding on the same state
+        with self.assertRaises(ActionConflict):
+            self.append(Action.REJECT, stage=first, version=version)
+
+        self.append(Action.CANCEL, version=version + 1)
+        with self.assertRaises(ActionConflict):
+            self.append(Action.CANCEL)
+
+        self.assertEqual(self.get_state().status, Action.CANCELLED)
+        self.assertEqual(
+            list(Action.objects.filter(title=self.title).order_by('path').values_list('action_type', flat=True)),
+            [Action.REQUEST, Action.APPROVE, Action.CANCEL],
+        )
+
+
+class ActionStorageTest(WorkflowTestCase):
+
+    def build_chain(self):
+        first, second = self.stages
+        request = self.append(Action.REQUEST)
+        self.append(Action.APPROVE, stage=first)
+        self.append(Action.APPROVE, stage=second)
+        return request
+
+    def get_nodes(self, request):
+        return list(request.get_chain().values_list('pk', 'sequence', 'path', 'depth', 'numchild'))
+
+    def test_convert_chain(self):
+        request = self.build_chain()
+        tree = self.get_nodes(request)
+        self.assertEqual([node[3] for node in tree], [1, 2, 3])
+
+        self.assertEqual(Action.convert_chain(request.pk, Action.FLAT_STORAGE), 2)
+        flat = self.get_nodes(request)
+        self.assertEqual([node[:2] for node in flat], [node[:2] for node in tree])
+        self.assertEqual([node[3:] for node in flat], [(1, 2), (2, 0), (2, 0)])
+        self.assertEqual(Action.find_problems(), ([], [], [], [], []))
+        self.assertEqual(Action.objects.get(pk=request.pk).last_action().pk, tree[-1][0])
+
+        self.assertEqual(Action.convert_chain(request.pk, Action.TREE_STORAGE), 2)
+        self.assertEqual(self.get_nodes(request), tree)
+        self.assertEqual(Action.convert_chain(request.pk, Action.TREE_STORAGE), 0)
+
+    @override_settings(WORKFLOWS_ACTION_STORAGE=Action.FLAT_STORAGE)
+    def test_flat_append(self):
+        request = self.build_chain()
+        self.assertEqual(list(request.get_chain().values_list('sequence', 'depth')), [(0, 1), (1, 2), (2, 2)])
+        self.assertEqual(self.get_state().status, Action.APPROVED)
+        # appended chains are valid trees and equal to converted ones
+        self.assertEqual(Action.find_problems(), ([], [], [], [], []))
+        flat = self.get_nodes(request)
+        self.assertEqual(Action.convert_chain(request.pk, Action.FLAT_STORAGE), 0)
+        self.assertEqual(self.get_nodes(request), flat)
+
+        Action.convert_chain(request.pk, Action.TREE_STORAGE)
+        self.assertEqual(list(request.get_chain().values_list('sequence', 'depth')), [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(Action.find_problems(), ([], [], [], [], []))
@@ -1,38 +1,86 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import logging
+import threading
+from collections import OrderedDict
 from copy import copy
-from lxml import etree
 
-from cms.models import Page, Title
+from cms.models import CMSPlugin, Page, Title
 from cms.plugin_rendering import ContentRenderer
+from cms.utils.plugins import downcast_plugins
 
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
-from django.http import Http404
+from django.db import transaction
+from django.db.models import Count
+from django.http import Http404, HttpRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils import translation
 from django.utils.functional import cached_property
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import TemplateView
 from django.views.generic.edit import FormView
-from lxml.html.diff import htmldiff, parse_html
-
 from sekizai.context import SekizaiContext
 
+from . import cache, diff, outbox
+from .context import WorkflowContext
 from .email import send_action_mails
 from .forms import ActionForm
-from .models import Action, Workflow
+from .models import Action, ActionConflict, DiffSnapshot
+
+logger = logging.getLogger('django.cms-workflows')
 
 
 NO_WORKFLOW = _('There is no workflow for this page and language.')
 ACTIVE_REQUEST = _('There already is an active request for this page and language.')
 NO_ACTIVE_REQUEST = _('There is no active request for this page and language.')
 USER_NOT_ALLOWED = _('You are not allowed to approve or reject this request.')
+ALREADY_HANDLED = _('This request has already been handled by someone else in the meantime.')
 
 # this closes the admin sideframe overlay and redirects to 'url' (in context)
 CLOSE_FRAME = 'workflows/admin/action_confirm.html'
 
 
+def on_close(response, func, *args):
+    """
+    Calls `func` once the response has been sent, when the transaction of the request has been
+    committed even with `ATOMIC_REQUESTS`.
+    """
+    close = response.close
+
+    def close_and_call():
+        close()
+        func(*args)
+
+    response.close = close_and_call
+    return response
+
+
+def get_render_request(page, language, user):
+    """
+    Builds a request to render the placeholders of a page with outside of any request, e.g. when
+    taking diff snapshots in the background. It does not pass any middleware, so it has neither a
+    toolbar nor a session and placeholders can only be rendered without being editable.
+
+    :type page: Page
+    :rtype: HttpRequest
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = page.get_absolute_url(language)
+    host, port = (page.site.domain.split(':') + ['80'])[:2]
+    request.META.update({'SERVER_NAME': host, 'SERVER_PORT': port})
+    request.user = user
+    request.current_page = page
+    request.LANGUAGE_CODE = language
+    return request
+
+
 class ActionView(FormView):
 
     template_name = 'workflows/admin/action_form.html'
@@ -67,6 +115,15 @@ class ActionView(FormView):
         except Page.DoesNotExist:
             raise Http404
 
+    @cached_property
+    def context(self):
+        """
+        Returns the workflow context of current page/language.
+
+        :rtype: WorkflowContext
+        """
+        return WorkflowContext.for_request(self.request, self.page, self.language)
+
     @cached_property
     def title(self):
         """
@@ -74,10 +131,9 @@ class ActionView(FormView):
 
         :rtype: Title
         """
-        try:
-            return self.page.title_set.get(language=self.language)
-        except Title.DoesNotExist:
+        if self.context.title is None:
             raise Http404
+        return self.context.title
 
     @cached_property
     def workflow(self):
@@ -86,7 +142,7 @@ class ActionView(FormView):
 
         :rtype: workflows.models.Workflow
         """
-        return Workflow.get_workflow(self.title)
+        return self.context.workflow
 
     @cached_property
     def user(self):
@@ -104,7 +160,7 @@ class ActionView(FormView):
 
         :rtype: Action
         """
-        return Action.get_current_request(self.title)
+        return self.context.current_request
 
     @cached_property
     def stage(self):
@@ -114,9 +170,7 @@ class ActionView(FormView):
 
         :rtype: workflows.models.WorkflowStage
         """
-        if not self.action_request:
-            return None
-        return self.action_request.last_action().get_next_stage(self.user)
+        return self.context.next_stage
 
     def validate(self):
         """Validates that this view can legally be called with all the current parameters.
@@ -174,10 +228,23 @@ class ActionView(FormView):
         return kwargs
 
     def form_valid(self, form):
-        action = form.save()
-        send_action_mails(action, editor=form.editor)
+        self.action = None
+        # queued mails are committed along with their action
+        try:
+            with transaction.atomic():
+                self.action = action = form.save()
+                if outbox.is_enabled():
+                    send_action_mails(action, editor=form.editor)
+        except ActionConflict:
+            messages.error(self.request, ALREADY_HANDLED)
+            return render(self.request, CLOSE_FRAME, {'url': self.get_success_url()})
         messages.success(self.request, self.confirm_message)
-        return render(self.request, CLOSE_FRAME, {'url': self.get_success_url()})
+        response = render(self.request, CLOSE_FRAME, {'url': self.get_success_url()})
+        if not outbox.is_enabled():
+            # a slow mail server must neither delay the response nor keep the transaction of the
+            # request open with `ATOMIC_REQUESTS`
+            on_close(response, send_action_mails, action, form.editor)
+        return response
 
     def get_context_data(self, **kwargs):
         """
@@ -210,6 +277,14 @@ class RequestView(ActionView):
         if self.action_request and not self.action_request.is_closed():
             raise InvalidAction(ACTIVE_REQUEST)
 
+    def form_valid(self, form):
+        response = super(RequestView, self).form_valid(form)
+        # nothing to capture if another request came first
+        if self.action is not None and DiffView.snapshots():
+            # with ATOMIC_REQUESTS the request is only committed once the view has returned
+            on_close(response, DiffView.capture, self.page.pk, self.language, self.action.pk, self.request.user.pk)
+        return response
+
 
 class ApproveRejectMixinView(object):
     def validate(self):
@@ -246,10 +321,18 @@ class DiffView(TemplateView):
     pk = None
     language = None
 
+    PUBLIC_PLACEHOLDER_KEY = 'workflows:diff:{language}:{version}:{changed}:{placeholder}'
+    PLUGINS_MODE, HTML_MODE, TEXT_MODE = 'plugins', 'html', 'text'
+    MODES = (PLUGINS_MODE, HTML_MODE, TEXT_MODE)
+    # title fields compared in text mode
+    TITLE_FIELDS = ('title', 'slug', 'menu_title', 'page_title', 'meta_description')
+    # replaced by the slot diffs when streaming
+    STREAM_MARKER = '<!-- workflows:diffs -->'
+
     def render_placeholder(self, placeholder, context):
         return placeholder.render(context, None, editable=False, use_cache=False, lang=self.language)
 
-    def render_page_placeholders(self, page, request):
+    def get_render_context(self, page, request):
         new_request = copy(request)
         setattr(new_request, 'current_page', page)
 
@@ -262,46 +345,530 @@ class DiffView(TemplateView):
             'request': copy(request),
             'cms_content_renderer': content_renderer,
         })
+        return context
+
+    def render_plugin(self, plugin, context):
+        return context['cms_content_renderer'].render_plugin(plugin, context, editable=False)
+
+    def render_concurrently(self, items, render_item, request):
+        """
+        Renders items, concurrently in a thread pool if `WORKFLOWS_DIFF_WORKERS` is set. Each worker
+        renders with its own context as contexts cannot be shared between threads.
+
+        :param items: (key, page, item) tuples
+        :param render_item: callable rendering an item with a render context
+        :return: {key: rendered} of all items rendered before the deadline
+        :rtype: dict
+        """
+        if not self.workers:
+            contexts = {}
+            rendered = {}
+            for key, page, item in items:
+                if self.deadline.passed():
+                    break
+                if page.pk not in contexts:
+                    contexts[page.pk] = self.get_render_context(page, request)
+                rendered[key] = render_item(item, contexts[page.pk])
+            return rendered
+
+        def task(page, item):
+            def render():
+                with translation.override(self.language):
+                    return render_item(item, self.get_render_context(page, request))
+            return render
+
+        tasks = {key: task(page, item) for key, page, item in items}
+        return diff.run_in_threads(tasks, self.workers, self.deadline)
+
+    def render_placeholders(self, placeholders, request):
+        """
+        :param placeholders: (page, placeholder) tuples
+        :return: {placeholder pk: rendered} of all placeholders rendered before the deadline
+        :rtype: dict
+        """
+        items = [(placeholder.pk, page, placeholder) for page, placeholder in placeholders]
+        return self.render_concurrently(items, self.render_placeholder, request)
+
+    def get_public_cache_key(self, page, placeholder):
+        return self.PUBLIC_PLACEHOLDER_KEY.format(
+            language=self.language,
+            version=cache.get_version(cache.public_diff_version_key(page.pk, self.language)),
+            changed=page.changed_date.strftime('%Y%m%d%H%M%S%f'),
+            placeholder=placeholder.pk,
+        )
+
+    def render_pages(self, public_page, draft_page, request, placeholders=None):
+        """
+        Renders the placeholders of the public and the draft page. As the public page only changes on
+        publishing, its rendered placeholders are cached until the page is published or unpublished
+        again.
+
+        :param placeholders: the public and the draft placeholders to render, defaults to all
+        :return: {slot: rendered} for the public and the draft page, slots that could not be rendered
+            before the deadline are `None`
+        :rtype: (OrderedDict, OrderedDict)
+        """
+        if placeholders is None:
+            placeholders = list(public_page.placeholders.all()), list(draft_page.placeholders.all())
+        public_placeholders, draft_placeholders = placeholders
+
+        shared = cache.get_cache()
+        keys = {placeholder.pk: self.get_public_cache_key(public_page, placeholder) for placeholder in public_placeholders}
+        cached = shared.get_many(list(keys.values()))
+        rendered = {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+        missing = [(public_page, placeholder) for placeholder in public_placeholders if placeholder.pk not in rendered]
+        rendered.update(self.render_placeholders(missing + [(draft_page, p) for p in draft_placeholders], request))
+
+        timeout = getattr(settings, 'WORKFLOWS_DIFF_CACHE_TIMEOUT', cache.get_timeout())
+        shared.set_many({
+            keys[placeholder.pk]: rendered[placeholder.pk]
+            for page, placeholder in missing if placeholder.pk in rendered
+        }, timeout)
+
+        return tuple(
+            OrderedDict((placeholder.slot, rendered.get(placeholder.pk)) for placeholder in placeholders)
+            for placeholders in (public_placeholders, draft_placeholders)
+        )
+
+    def get_plugin_trees(self, public_page, draft_page, placeholders=None):
+        """
+        Loads the plugins of both pages with one query plus one per plugin type.
+
+        :param placeholders: (page, placeholder) tuples to load the plugins of, defaults to all
+            placeholders of both pages
+        :return: {slot: [PluginNode]} for the public and the draft page
+        :rtype: (OrderedDict, OrderedDict)
+        """
+        if placeholders is None:
+            placeholders = self.get_placeholders(public_page, draft_page)
+        placeholders = OrderedDict((placeholder.pk, (page, placeholder)) for page, placeholder in placeholders)
+
+        plugins = CMSPlugin.objects.filter(
+            placeholder__in=list(placeholders), language=self.language,
+        ).order_by('path')
+        by_placeholder = {pk: [] for pk in placeholders}
+        for plugin in downcast_plugins(list(plugins), [placeholder for _, placeholder in placeholders.values()]):
+            by_placeholder[plugin.placeholder_id].append(plugin)
+
+        trees = OrderedDict(), OrderedDict()
+        for pk, (page, placeholder) in placeholders.items():
+            tree = trees[0] if page == public_page else trees[1]
+            tree[placeholder.slot] = diff.plugin_tree(by_placeholder[pk])
+        return trees
+
+    def get_placeholders(self, public_page, draft_page):
+        """
+        :return: (page, placeholder) tuples of both pages
+        :rtype: list
+        """
+        return [
+            (page, placeholder)
+            for page in (public_page, draft_page) if page is not None
+            for placeholder in page.placeholders.all()
+        ]
+
+    def get_html_diffs(self, public_page, draft_page, placeholders=None):
+        """
+        Diffs the rendered placeholders of both pages.
+
+        :param placeholders: see `render_pages`
+        :rtype: list[diff.SlotDiff]
+        """
+        public_page, draft_page = self.render_pages(public_page, draft_page, self.request, placeholders)
+
+        # slots only present in the draft are added at the end
+        slots = list(public_page) + [slot for slot in draft_page if slot not in public_page]
+        states = OrderedDict()
+        changed = {}
+        for slot in slots:
+            public_rendered, draft_rendered = public_page.get(slot, ''), draft_page.get(slot, '')
+            if public_rendered is None or draft_rendered is None:
+                states[slot] = diff.TIMEOUT
+            elif slot not in public_page:
+                states[slot] = diff.ADDED
+            elif slot not in draft_page:
+                states[slot] = diff.REMOVED
+            elif diff.content_hash(public_rendered) == diff.content_hash(draft_rendered):
+                states[slot] = diff.UNCHANGED
+            else:
+                states[slot] = diff.CHANGED
+            if states[slot] in (diff.ADDED, diff.REMOVED, diff.CHANGED):
+                changed[slot] = (public_rendered, draft_rendered)
+
+        slot_diffs = diff.diff_slots(
+            changed,
+            workers=self.workers,
+            deadline=self.deadline,
+            process_threshold=self.process_threshold,
+        )
+
+        diffs = []
+        for slot, state in states.items():
+            if state == diff.UNCHANGED:
+                diffs.append(diff.SlotDiff(slot, state, public_page[slot]))
+            elif slot in slot_diffs:
+                diffs.append(diff.SlotDiff(slot, state, slot_diffs[slot]))
+            else:
+                diffs.append(diff.SlotDiff(slot, diff.TIMEOUT, ''))
+        return diffs
+
+    def get_plugin_diffs(self, public_page, draft_page, trees):
+        """
+        Aligns the plugin trees of both pages and only renders and diffs plugins which were changed,
+        added or removed. Unchanged and moved plugins are listed without being rendered.
 
-        return {
-            placeholder.slot: self.render_placeholder(placeholder, context) for placeholder in page.placeholders.all()
+        :param trees: see `get_plugin_trees`
+        :rtype: list[diff.SlotDiff]
+        """
+        public_trees, draft_trees = trees
+        slots = list(public_trees) + [slot for slot in draft_trees if slot not in public_trees]
+
+        changes = OrderedDict(
+            (slot, diff.align_plugins(public_trees.get(slot, []), draft_trees.get(slot, [])))
+            for slot in slots
+        )
+
+        items = []
+        for slot, slot_changes in changes.items():
+            for index, change in enumerate(slot_changes):
+                if change.state in (diff.CHANGED, diff.REMOVED):
+                    items.append(((slot, index, 'public'), public_page, change.public.instance))
+                if change.state in (diff.CHANGED, diff.ADDED):
+                    items.append(((slot, index, 'draft'), draft_page, change.draft.instance))
+        rendered = self.render_concurrently(items, self.render_plugin, self.request)
+
+        # plugins which could not be rendered before the deadline are left out and shown as timeout
+        pending = {}
+        for slot, slot_changes in changes.items():
+            for index, change in enumerate(slot_changes):
+                if change.state == diff.CHANGED:
+                    keys = (slot, index, 'public'), (slot, index, 'draft')
+                elif change.state == diff.REMOVED:
+                    keys = (slot, index, 'public'),
+                elif change.state == diff.ADDED:
+                    keys = (slot, index, 'draft'),
+                else:
+                    continue
+                if all(key in rendered for key in keys):
+                    pending[(slot, index)] = (
+                        rendered.get((slot, index, 'public'), ''),
+                        rendered.get((slot, index, 'draft'), ''),
+                    )
+
+        plugin_diffs = diff.diff_slots(
+            pending,
+            workers=self.workers,
+            deadline=self.deadline,
+            process_threshold=self.process_threshold,
+        )
+
+        diffs = []
+        for slot, slot_changes in changes.items():
+            if slot not in draft_trees:
+                state = diff.REMOVED
+            elif slot not in public_trees:
+                state = diff.ADDED
+            elif all(change.state == diff.UNCHANGED for change in slot_changes):
+                state = diff.UNCHANGED
+            else:
+                state = diff.CHANGED
+
+            entries = []
+            for index, change in enumerate(slot_changes):
+                if change.state in (diff.UNCHANGED, diff.MOVED):
+                    html = ''
+                elif (slot, index) in plugin_diffs:
+                    html = plugin_diffs[(slot, index)]
+                else:
+                    state = diff.TIMEOUT
+                    break
+                entries.append({
+                    'state': change.state,
+                    'plugin': (change.draft or change.public).instance,
+                    'html': html,
+                })
+
+            if state == diff.TIMEOUT:
+                diffs.append(diff.SlotDiff(slot, state, ''))
+            else:
+                html = render_to_string('workflows/admin/plugin_diff.html', {'entries': entries})
+                diffs.append(diff.SlotDiff(slot, state, html))
+        return diffs
+
+    def get_text_diffs(self, trees):
+        """
+        Diffs the visible text of the plugins of both pages.
+
+        :param trees: see `get_plugin_trees`
+        :rtype: list[diff.SlotDiff]
+        """
+        public_trees, draft_trees = trees
+        slots = list(public_trees) + [slot for slot in draft_trees if slot not in public_trees]
+
+        diffs = []
+        for slot in slots:
+            public_lines = diff.tree_text(public_trees.get(slot, []))
+            draft_lines = diff.tree_text(draft_trees.get(slot, []))
+            if slot not in draft_trees:
+                state = diff.REMOVED
+            elif slot not in public_trees:
+                state = diff.ADDED
+            elif public_lines == draft_lines:
+                state = diff.UNCHANGED
+            else:
+                state = diff.CHANGED
+            diffs.append(diff.SlotDiff(slot, state, diff.diff_text(public_lines, draft_lines)))
+        return diffs
+
+    def get_title_diffs(self, page):
+        """
+        Diffs the metadata of the public and the draft title.
+
+        :return: (field label, diff) of all changed fields
+        :rtype: list
+        """
+        titles = {
+            title.publisher_is_draft: title
+            for title in Title.objects.filter(page__in=(page.pk, page.publisher_public_id), language=self.language)
         }
+        draft_title, public_title = titles.get(True), titles.get(False)
+
+        changes = []
+        for name in self.TITLE_FIELDS:
+            public_value = getattr(public_title, name, None) or ''
+            draft_value = getattr(draft_title, name, None) or ''
+            if public_value != draft_value:
+                changes.append((Title._meta.get_field(name).verbose_name, diff.diff_words(public_value, draft_value)))
+        return changes
+
+    @cached_property
+    def workers(self):
+        return getattr(settings, 'WORKFLOWS_DIFF_WORKERS', 0)
+
+    @cached_property
+    def process_threshold(self):
+        return getattr(settings, 'WORKFLOWS_DIFF_PROCESS_THRESHOLD', 100000)
+
+    @cached_property
+    def mode(self):
+        """
+        'plugins' aligns the plugin trees and only diffs changed plugins, 'html' diffs the rendered
+        placeholders as a whole and 'text' diffs the plugins' text without rendering anything. The
+        default is `WORKFLOWS_DIFF_MODE` and can be overridden with `?mode=`.
+
+        :rtype: str
+        """
+        mode = self.request.GET.get('mode')
+        if mode in self.MODES:
+            return mode
+        return getattr(settings, 'WORKFLOWS_DIFF_MODE', self.PLUGINS_MODE)
+
+    @cached_property
+    def streaming(self):
+        """
+        Whether the diffs are streamed slot by slot, either with `?stream=1` or
+        `WORKFLOWS_DIFF_STREAM`.
+
+        :rtype: bool
+        """
+        if 'stream' in self.request.GET:
+            return self.request.GET['stream'] not in ('', '0')
+        return getattr(settings, 'WORKFLOWS_DIFF_STREAM', False)
+
+    @staticmethod
+    def snapshots():
+        return getattr(settings, 'WORKFLOWS_DIFF_SNAPSHOTS', True)
+
+    @cached_property
+    def page(self):
+        return get_object_or_404(Page, pk=self.pk)
+
+    @cached_property
+    def action_request(self):
+        """
+        Returns the current request of the page if it is still open and snapshots are enabled.
+
+        :rtype: Action | None
+        """
+        if not self.snapshots():
+            return None
+        action_request = WorkflowContext.for_request(self.request, self.page.get_draft_object(), self.language).current_request
+        if action_request is None or action_request.is_closed():
+            return None
+        return action_request
+
+    def get_diffs(self, page, action_request=None, stream=False):
+        """
+        Returns the diffs of the page. For an open `action_request`, its snapshot is served as long
+        as the draft's plugins did not change since it was taken, otherwise the diffs are computed
+        and stored as the request's new snapshot. Streamed diffs are never stored as that would
+        hold all slots at once, requests are captured when they are created anyway.
+
+        :type page: Page
+        :type action_request: Action
+        :param stream: compute the diffs lazily slot by slot instead of all at once
+        :rtype: collections.Iterable[diff.SlotDiff]
+        """
+        public_page, draft_page = page.get_public_object(), page.get_draft_object()
+        if self.mode == self.TEXT_MODE:
+            # nothing is rendered, so there is nothing worth a snapshot either
+            return self.get_text_diffs(self.get_plugin_trees(public_page, draft_page))
+
+        if stream:
+            if action_request is not None:
+                # only the draft's plugins are loaded up front, and only to be hashed
+                draft_hash = self.get_draft_hash(self.get_plugin_trees(None, draft_page)[1])
+                snapshot = self.get_snapshot(action_request, draft_hash)
+                if snapshot is not None:
+                    return snapshot.get_diffs()
+            return self.iter_slot_diffs(public_page, draft_page)
+
+        trees = self.get_plugin_trees(public_page, draft_page)
+        draft_hash = self.get_draft_hash(trees[1])
+        if action_request is not None:
+            snapshot = self.get_snapshot(action_request, draft_hash)
+            if snapshot is not None:
+                return snapshot.get_diffs()
+
+        if self.mode == self.PLUGINS_MODE:
+            diffs = self.get_plugin_diffs(public_page, draft_page, trees)
+        else:
+            diffs = self.get_html_diffs(public_page, draft_page)
+
+        if action_request is not None:
+            self.take_snapshot(diffs, action_request, draft_hash)
+        return diffs
+
+    def get_draft_hash(self, draft_trees):
+        """
+        :param draft_trees: {slot: [PluginNode]} of the draft page
+        :rtype: str
+        """
+        return diff.content_hash('{}:{}'.format(self.mode, diff.tree_hash(draft_trees)))
+
+    def get_snapshot(self, action_request, draft_hash):
+        """
+        :return: the request's snapshot if it is still up to date with the draft
+        :rtype: DiffSnapshot | None
+        """
+        snapshot = DiffSnapshot.objects.filter(request=action_request).first()
+        if snapshot is not None and snapshot.draft_hash == draft_hash:
+            return snapshot
+        return None
+
+    def take_snapshot(self, diffs, action_request, draft_hash):
+        """
+        Stores the diffs as snapshot of the request if they are complete.
+
+        :type diffs: list[diff.SlotDiff]
+        """
+        # incomplete diffs are not worth keeping
+        if not any(slot_diff.state == diff.TIMEOUT for slot_diff in diffs):
+            DiffSnapshot.objects.update_or_create(request=action_request, defaults={
+                'draft_hash': draft_hash,
+                'data': diff.pack(diffs),
+            })
+
+    def iter_slot_diffs(self, public_page, draft_page):
+        """
+        Computes the diffs one slot at a time, slots with the fewest plugins first. The plugins of
+        a slot are only loaded when it is diffed, so only a single slot's plugins and renderings
+        are held at once.
+
+        :rtype: collections.Iterator[diff.SlotDiff]
+        """
+        placeholders = self.get_placeholders(public_page, draft_page)
+        counts = dict(
+            CMSPlugin.objects.filter(
+                placeholder__in=[placeholder.pk for _, placeholder in placeholders], language=self.language,
+            ).order_by().values_list('placeholder').annotate(Count('pk'))
+        )
+
+        sizes = OrderedDict()
+        for page, placeholder in placeholders:
+            sizes[placeholder.slot] = sizes.get(placeholder.slot, 0) + counts.get(placeholder.pk, 0)
+        slots = sorted(sizes, key=sizes.get)
+
+        for slot in slots:
+            slot_placeholders = [(page, placeholder) for page, placeholder in placeholders if placeholder.slot == slot]
+            if self.mode == self.PLUGINS_MODE:
+                trees = self.get_plugin_trees(public_page, draft_page, slot_placeholders)
+                yield self.get_plugin_diffs(public_page, draft_page, trees)[0]
+            else:
+                yield self.get_html_diffs(public_page, draft_page, (
+                    [placeholder for page, placeholder in slot_placeholders if page == public_page],
+                    [placeholder for page, placeholder in slot_placeholders if page == draft_page],
+                ))[0]
+
+    def stream(self, context):
+        """
+        Renders the page around the diffs first and then each slot's diff as soon as it is computed.
+        """
+        head, tail = render_to_string(self.template_name, context, request=self.request).split(self.STREAM_MARKER)
+        yield head
+
+        partial = False
+        for slot_diff in self.get_diffs(self.page, self.action_request, stream=True):
+            partial = partial or slot_diff.state == diff.TIMEOUT
+            yield render_to_string('workflows/admin/slot_diff.html', {'diff': slot_diff})
+
+        if partial:
+            yield render_to_string('workflows/admin/diff_partial.html')
+        yield tail
+
+    @classmethod
+    def capture(cls, page_pk, language, request_pk, user_pk):
+        """
+        Takes the snapshot of a new request, in a background thread unless
+        `WORKFLOWS_DIFF_SNAPSHOT_ASYNC` is `False`. Snapshots are taken without deadline.
+        Everything is loaded by pk, so this must only be called once the request is committed.
+        """
+        def capture():
+            try:
+                action_request = Action.objects.filter(pk=request_pk).first()
+                if action_request is None:
+                    # the request has been rolled back
+                    return
+                page = Page.objects.get(pk=page_pk)
+                user = get_user_model().objects.get(pk=user_pk)
+                with translation.override(language):
+                    view = cls(request=get_render_request(page, language, user))
+                    view.pk, view.language, view.deadline = page_pk, language, diff.Deadline()
+                    list(view.get_diffs(page, action_request))
+            except Exception:
+                # approvers will compute the diff themselves
+                logger.exception('Could not take diff snapshot of request #%s', request_pk)
+
+        if getattr(settings, 'WORKFLOWS_DIFF_SNAPSHOT_ASYNC', True):
+            threading.Thread(target=diff._in_thread, args=(capture,)).start()
+        else:
+            capture()
 
     def get(self, request, *args, **kwargs):
         self.pk = args[0]
         self.language = args[1]
+        self.deadline = diff.Deadline(getattr(settings, 'WORKFLOWS_DIFF_TIMEOUT', None))
 
+        if self.streaming:
+            return StreamingHttpResponse(self.stream(self.get_context_data(**kwargs)))
         return super(DiffView, self).get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super(DiffView, self).get_context_data(**kwargs)
+        context['title'] = _('Show current changes')
+        if self.mode == self.TEXT_MODE:
+            context['title_diffs'] = self.get_title_diffs(self.page.get_draft_object())
 
-        page = get_object_or_404(Page, pk=self.pk)
-        public_page = self.render_page_placeholders(page.get_public_object(), self.request)
-        draft_page = self.render_page_placeholders(page.get_draft_object(), self.request)
-
-        diffs = []
-        for slot, public_rendered in public_page.items():
-            draft_rendered = draft_page.pop(slot, [])
-
-            diff = htmldiff(public_rendered, draft_rendered)
-            tree = parse_html(diff, cleanup=False)
-
-            for item in tree.xpath("//ins | //del"):
-                if len(item):
-                    continue
-
-                content = item.text
-                if not (content and content.strip()):
-                    item.getparent().remove(item)
-
-            diffs.append(etree.tostring(tree, method='html'))
+        if self.streaming:
+            context['stream_marker'] = mark_safe(self.STREAM_MARKER)
+            return context
 
+        diffs = list(self.get_diffs(self.page, self.action_request))
         context.update({
-            'title': _('Show current changes'),
             'diffs': diffs,
+            'partial': any(slot_diff.state == diff.TIMEOUT for slot_diff in diffs),
         })
-
         return context
 
 